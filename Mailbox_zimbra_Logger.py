@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
 import re
+import os
+import sys
+import csv
+import json
+import sqlite3
+import heapq
+import mmap
+import argparse
 from collections import Counter
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
-LOG_PATH = '/opt/zimbra/log/mailbox.log'
+from zimbra_log_ingest import DetectorMailbox, Ingesta, posicion_a_dict, posicion_desde_dict
 
-# Regex para extraer fecha y hora al inicio de línea
-regex_datetime = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})')
+LOG_PATH = '/opt/zimbra/log/mailbox.log'
+INDICE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mailbox_rollup.sqlite3')  # Rollup horario (--indice)
 
-# Regex para invalid password y account lockout (captura name y oip)
-regex_general = re.compile(
-    r'\[name=([^;\]]+).*?oip=(\d+\.\d+\.\d+\.\d+)',
-    re.IGNORECASE
-)
 VIOLETA = '\033[95m'
 RED = '\033[91m'
 GREEN = '\033[92m'
@@ -19,79 +24,470 @@ YELLOW = '\033[93m'
 CYAN = '\033[96m'
 RESET = '\033[0m'
 
-# Regex para account not found: captura correo tras 'authentication failed for [correo]'
-regex_account_not_found = re.compile(
-    r'authentication failed for \[([^\]]+)\]',
-    re.IGNORECASE
-)
+# Marca de tiempo al inicio de línea en bytes, para ubicar --desde/--hasta sin decodificar
+regex_marca = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}')
+LARGO_MARCA = 23
+FACTOR_CAPACIDAD_TOP_K = 10  # En modo --top-k se guardan K * factor contadores por categoría
 
-# Regex para capturar cualquier IP (oip o ip) en la línea
-regex_ip = re.compile(
-    r'\[(?:oip|ip)=(\d+\.\d+\.\d+\.\d+)',
-    re.IGNORECASE
+# Categorías del reporte, en el orden en que se imprimen
+CATEGORIAS = (
+    ('invalid_password', "Intentos fallidos por 'invalid password'"),
+    ('account_lockout', "Intentos de 'account lockout'"),
+    ('account_not_found', "Intentos con cuentas no existentes ('account not found')"),
 )
 
-def analizar_logs(path):
-    invalid_password = Counter()
-    account_lockout = Counter()
-    account_not_found = Counter()
 
-    # Para guardar hora y conteo, usaremos diccionarios
-    invalid_password_times = {}
-    account_lockout_times = {}
-    account_not_found_times = {}
+class ResumenTopK:
+    """
+    Resumen Space-Saving (Metwally et al.) de memoria fija: guarda como mucho 'capacidad' claves.
+    Cuando está lleno, una clave nueva desplaza a la de menor cuenta y hereda esa cuenta como
+    error. Para cada clave guardada: cuenta - error <= real <= cuenta, y error <= total / capacidad.
+    Toda clave con más de total / capacidad apariciones está garantizada en el resumen.
+    """
+
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self.total = 0
+        self.cuentas = {}
+        self.errores = {}
+        self.horas = {}  # Hora del último intento de cada clave guardada
+        self.monticulo = []  # (cuenta, orden, clave); entradas viejas se descartan al salir
+        self.orden = 0
+
+    def __len__(self):
+        return len(self.cuentas)
+
+    def _apilar(self, clave, cuenta):
+        self.orden += 1
+        heapq.heappush(self.monticulo, (cuenta, self.orden, clave))
+        if len(self.monticulo) > 4 * self.capacidad:
+            self._reconstruir()
+
+    def _reconstruir(self):
+        self.monticulo = [(cuenta, i, clave) for i, (clave, cuenta) in enumerate(self.cuentas.items())]
+        heapq.heapify(self.monticulo)
+        self.orden = len(self.monticulo)
+
+    def _desalojar_minimo(self):
+        while True:
+            cuenta, _, clave = heapq.heappop(self.monticulo)
+            if self.cuentas.get(clave) == cuenta:
+                del self.cuentas[clave], self.errores[clave], self.horas[clave]
+                return cuenta
+
+    def minimo(self):
+        # Cota de lo que pudo contar una clave ausente: 0 mientras no se haya llenado
+        if len(self.cuentas) < self.capacidad:
+            return 0
+        while True:
+            cuenta, _, clave = self.monticulo[0]
+            if self.cuentas.get(clave) == cuenta:
+                return cuenta
+            heapq.heappop(self.monticulo)
+
+    def registrar(self, clave, hora):
+        self.total += 1
+        cuenta = self.cuentas.get(clave)
+        if cuenta is None:
+            error = self._desalojar_minimo() if len(self.cuentas) >= self.capacidad else 0
+            self.errores[clave] = error
+            cuenta = error
+        self.cuentas[clave] = cuenta + 1
+        self.horas[clave] = hora
+        self._apilar(clave, cuenta + 1)
+
+    def fusionar(self, otro):
+        # Fusión de resúmenes Space-Saving (Agarwal et al.): a las claves que faltan en un lado se
+        # les suma el mínimo de ese lado, y se conservan las 'capacidad' mayores
+        min_propio, min_otro = self.minimo(), otro.minimo()
+        cuentas, errores = {}, {}
+        for clave, cuenta in self.cuentas.items():
+            cuentas[clave] = cuenta + otro.cuentas.get(clave, min_otro)
+            errores[clave] = self.errores[clave] + otro.errores.get(clave, min_otro)
+        for clave, cuenta in otro.cuentas.items():
+            if clave not in cuentas:
+                cuentas[clave] = cuenta + min_propio
+                errores[clave] = otro.errores[clave] + min_propio
+        horas = {**self.horas, **otro.horas}  # 'otro' es posterior en el log
+        conservadas = sorted(cuentas, key=cuentas.__getitem__, reverse=True)[:self.capacidad]
+        self.cuentas = {clave: cuentas[clave] for clave in conservadas}
+        self.errores = {clave: errores[clave] for clave in conservadas}
+        self.horas = {clave: horas[clave] for clave in conservadas}
+        self.total += otro.total
+        self._reconstruir()
+
+    def cota_error(self):
+        return self.total // self.capacidad
+
+    def values(self):
+        return self.cuentas.values()
+
+    def most_common(self, n=None):
+        # Mismo contrato que Counter.most_common(), con la cuenta estimada (cota superior)
+        claves = sorted(self.cuentas.items(), key=lambda item: item[1], reverse=True)
+        return claves if n is None else claves[:n]
+
+
+class ResultadoAnalisis:
+    """
+    Conteo por clave (correo, ip) y hora del último intento, para cada categoría.
+    Con top_k usa un ResumenTopK de memoria fija por categoría en lugar de Counter.
+    Los resultados parciales de cada trozo del archivo se fusionan en orden con fusionar().
+    """
+
+    def __init__(self, top_k=None):
+        self.top_k = top_k
+        if top_k:
+            self.contadores = {categoria: ResumenTopK(top_k * FACTOR_CAPACIDAD_TOP_K) for categoria, _ in CATEGORIAS}
+            self.tiempos = {categoria: resumen.horas for categoria, resumen in self.contadores.items()}
+        else:
+            self.contadores = {categoria: Counter() for categoria, _ in CATEGORIAS}
+            self.tiempos = {categoria: {} for categoria, _ in CATEGORIAS}
 
+    def registrar(self, categoria, correo, ip, datetime_str):
+        # Clave como tupla de cadenas internadas: cada correo/IP repetido ocupa memoria una sola vez
+        clave = (sys.intern(correo), sys.intern(ip))
+        if self.top_k:
+            self.contadores[categoria].registrar(clave, datetime_str)
+        else:
+            self.contadores[categoria][clave] += 1
+            self.tiempos[categoria][clave] = datetime_str
+
+    def fusionar(self, otro):
+        # 'otro' debe corresponder a una parte posterior del log: sus horas pisan a las anteriores
+        for categoria, _ in CATEGORIAS:
+            if self.top_k:
+                self.contadores[categoria].fusionar(otro.contadores[categoria])
+                self.tiempos[categoria] = self.contadores[categoria].horas
+            else:
+                self.contadores[categoria].update(otro.contadores[categoria])
+                self.tiempos[categoria].update(otro.tiempos[categoria])
+
+
+def ingesta_reporte(resultado):
+    # Ingesta de mailbox.log cuyos eventos van al registrar() del reporte o del índice horario
+    return Ingesta([DetectorMailbox()], [lambda e: resultado.registrar(e.categoria, e.cuenta, e.ip, e.fecha)])
+
+
+def escanear_serial(path, top_k=None, inicio=0, fin=None):
+    # Clasifica el rango [inicio, fin) del archivo (por defecto, el archivo entero)
+    resultado = ResultadoAnalisis(top_k)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return resultado  # mmap no admite archivos vacíos
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ingesta_reporte(resultado).procesar(mm, inicio, len(mm) if fin is None else fin)
+    return resultado
+
+
+def dividir_en_rangos(path, partes, inicio=0, fin=None):
+    # Corta [inicio, fin) en 'partes' rangos de bytes que empiezan justo después de un salto de línea
+    if fin is None:
+        fin = os.path.getsize(path)
+    largo = fin - inicio
+    if largo <= 0:
+        return []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        cortes = [inicio]
+        for k in range(1, partes):
+            salto = mm.find(b'\n', max(inicio + k * largo // partes, cortes[-1]), fin)
+            if salto == -1:
+                break
+            if salto + 1 < fin and salto + 1 > cortes[-1]:
+                cortes.append(salto + 1)
+        cortes.append(fin)
+    return list(zip(cortes, cortes[1:]))
+
+
+def escanear_rango(path, inicio, fin, top_k=None):
+    # Worker: clasifica las líneas del rango [inicio, fin) leyendo el archivo vía mmap
+    resultado = ResultadoAnalisis(top_k)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        ingesta_reporte(resultado).procesar(mm, inicio, fin)
+    return resultado
+
+
+def escanear_paralelo(path, procesos, top_k=None, inicio=0, fin=None):
+    rangos = dividir_en_rangos(path, procesos, inicio, fin)
+    resultado = ResultadoAnalisis(top_k)
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        # map devuelve los parciales en el orden del archivo, que es el orden en que hay que fusionar
+        inicios = [inicio for inicio, _ in rangos]
+        fines = [fin for _, fin in rangos]
+        for parcial in pool.map(escanear_rango, [path] * len(rangos), inicios, fines, [top_k] * len(rangos)):
+            resultado.fusionar(parcial)
+    return resultado
+
+
+# --- Ventana de tiempo (--desde / --hasta) ---
+def parsear_instante(texto):
+    """
+    Convierte 'AAAA-MM-DD[ HH:MM[:SS[,mmm]]]' o una antigüedad relativa ('90m', '1h', '2d')
+    en la marca de tiempo en bytes con el formato de mailbox.log.
+    """
+    texto = texto.strip()
+    unidades = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
     try:
-        with open(path, 'r') as f:
-            for linea in f:
-                linea_lower = linea.lower()
-                if 'authentication failed' in linea_lower:
-                    # Extraer fecha y hora
-                    dt_match = regex_datetime.search(linea)
-                    datetime_str = dt_match.group(1) if dt_match else "Fecha no encontrada"
-
-                    if 'invalid password' in linea_lower or 'account lockout' in linea_lower:
-                        match = regex_general.search(linea)
-                        if match:
-                            correo = match.group(1).strip()
-                            ip = match.group(2).strip()
-                            clave = f"{correo} | {ip}"
-                            if 'invalid password' in linea_lower:
-                                invalid_password[clave] += 1
-                                invalid_password_times[clave] = datetime_str
-                            else:
-                                account_lockout[clave] += 1
-                                account_lockout_times[clave] = datetime_str
-
-                    elif 'account not found' in linea_lower:
-                        match_correo = regex_account_not_found.search(linea)
-                        match_ip = regex_ip.search(linea)
-                        if match_correo:
-                            correo_nf = match_correo.group(1).strip()
-                            ip_nf = match_ip.group(1).strip() if match_ip else "IP no encontrada"
-                            clave_nf = f"{correo_nf} | {ip_nf}"
-                            account_not_found[clave_nf] += 1
-                            account_not_found_times[clave_nf] = datetime_str
-
-        # Mostrar resultados con la hora del último intento registrado
-        def imprimir_resultados(titulo, contador, tiempos):
-            print(f"\n{titulo}:")
-            if contador:
-                for clave, cantidad in contador.most_common():
-                    hora = tiempos.get(clave, "Fecha no encontrada")
-                    print(f"{CYAN}{clave}{RESET} → {VIOLETA}{cantidad} intentos{RESET} (último intento: {GREEN}{hora}{RESET})")
+        if texto[-1:] in unidades and texto[:-1].isdigit():
+            instante = datetime.now() - timedelta(**{unidades[texto[-1]]: int(texto[:-1])})
+        else:
+            instante = datetime.fromisoformat(texto.replace(',', '.'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha no válida: {texto!r} (AAAA-MM-DD HH:MM[:SS] o 90m/1h/2d)")
+    return f"{instante:%Y-%m-%d %H:%M:%S},{instante.microsecond // 1000:03d}".encode('ascii')
+
+
+def linea_con_marca(mm, pos, fin):
+    # Primera línea que empieza en pos o después y lleva marca de tiempo; las continuaciones
+    # (stack traces) no la llevan y se saltan. Devuelve (offset, marca) o (fin, None).
+    if pos > 0 and mm[pos - 1:pos] != b'\n':
+        salto = mm.find(b'\n', pos, fin)
+        pos = fin if salto == -1 else salto + 1
+    while pos < fin:
+        if regex_marca.match(mm, pos, fin):
+            return pos, mm[pos:pos + LARGO_MARCA]
+        salto = mm.find(b'\n', pos, fin)
+        pos = fin if salto == -1 else salto + 1
+    return fin, None
+
+
+def buscar_offset(mm, marca, inicio, fin):
+    # Búsqueda binaria sobre offsets de bytes: primera línea con marca >= 'marca'. Las marcas
+    # 'AAAA-MM-DD HH:MM:SS,mmm' ordenan igual como bytes que como fechas.
+    bajo, alto = inicio, fin
+    while bajo < alto:
+        medio = (bajo + alto) // 2
+        _, encontrada = linea_con_marca(mm, medio, fin)
+        if encontrada is None or encontrada >= marca:
+            alto = medio
+        else:
+            bajo = medio + 1
+    return linea_con_marca(mm, bajo, fin)[0]
+
+
+def rango_temporal(path, desde=None, hasta=None):
+    """
+    Rango de bytes [inicio, fin) con las líneas de [desde, hasta). Cuesta O(log tamaño) lecturas,
+    así que una ventana de una hora sobre un log de decenas de GB se ubica en milisegundos.
+    Supone el log en orden cronológico, como lo escribe Zimbra.
+    """
+    tamano = os.path.getsize(path)
+    if tamano == 0:
+        return 0, 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        inicio = buscar_offset(mm, desde, 0, tamano) if desde else 0
+        fin = buscar_offset(mm, hasta, inicio, tamano) if hasta else tamano
+    return inicio, fin
+
+
+# --- Índice horario persistente (--indice) ---
+class AgregadoHorario:
+    """
+    Conteo por (hora, categoría, cuenta, ip) con el último intento, acumulado en una pasada
+    incremental. Tiene el mismo registrar() que ResultadoAnalisis, así que los clasificadores
+    escriben en él sin cambios.
+    """
+
+    def __init__(self):
+        self.filas = {}
+
+    def registrar(self, categoria, correo, ip, datetime_str):
+        # Hora 'AAAA-MM-DD HH'; las líneas sin fecha van a la hora '' y sólo salen sin --desde/--hasta
+        hora = datetime_str[:13] if datetime_str[:1].isdigit() else ''
+        clave = (hora, categoria, sys.intern(correo), sys.intern(ip))
+        fila = self.filas.get(clave)
+        if fila is None:
+            self.filas[clave] = [1, datetime_str if hora else '']
+        else:
+            fila[0] += 1
+            if hora:
+                fila[1] = datetime_str
+
+
+class IndiceHorario:
+    """
+    Rollup en SQLite de los fallos por (hora, categoría, cuenta, ip) con cantidad y último intento.
+    Cada actualización suma sólo lo añadido al log desde el offset guardado, en la misma transacción
+    que el nuevo offset. Reportes y exportaciones se generan desde aquí sin releer el log.
+    Si lo alimenta otro proceso que ya sigue el log (zimbra_log_ip_blocker), queda anotado en meta.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS rollup ('
+                              'hora TEXT NOT NULL, categoria TEXT NOT NULL, cuenta TEXT NOT NULL, ip TEXT NOT NULL, '
+                              'intentos INTEGER NOT NULL, ultimo TEXT NOT NULL, '
+                              'PRIMARY KEY (hora, categoria, cuenta, ip)) WITHOUT ROWID')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)')
+
+    def cargar_checkpoint(self):
+        fila = self.conn.execute("SELECT valor FROM meta WHERE clave = 'checkpoint'").fetchone()
+        return posicion_desde_dict(json.loads(fila[0]) if fila else {})
+
+    def alimentador(self):
+        fila = self.conn.execute("SELECT valor FROM meta WHERE clave = 'alimentador'").fetchone()
+        return fila[0] if fila else None
+
+    def confirmar(self, agregado, checkpoint, alimentador=None):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO rollup (hora, categoria, cuenta, ip, intentos, ultimo) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (hora, categoria, cuenta, ip) DO UPDATE SET '
+                'intentos = intentos + excluded.intentos, ultimo = max(ultimo, excluded.ultimo)',
+                [(*clave, intentos, ultimo) for clave, (intentos, ultimo) in agregado.filas.items()])
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('checkpoint', ?)",
+                              (json.dumps(posicion_a_dict(checkpoint)),))
+            if alimentador:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('alimentador', ?)", (alimentador,))
+
+    @staticmethod
+    def filtro(desde, hasta):
+        # --desde/--hasta redondeados a horas completas: entra toda hora que se solape con la ventana
+        condiciones, parametros = [], []
+        if desde:
+            condiciones.append('hora >= ?')
+            parametros.append(desde[:13].decode('ascii'))
+        if hasta:
+            condiciones.append('hora < ?' if hasta[13:] == b':00:00,000' else 'hora <= ?')
+            parametros.append(hasta[:13].decode('ascii'))
+        return ''.join(f' AND {c}' for c in condiciones), parametros
+
+    def resultado(self, desde=None, hasta=None, top_k=None):
+        # Totales por (cuenta, ip) de cada categoría dentro de la ventana; con top_k, sólo los K mayores
+        donde, parametros = self.filtro(desde, hasta)
+        resultado = ResultadoAnalisis()
+        for categoria, _ in CATEGORIAS:
+            consulta = (f'SELECT cuenta, ip, SUM(intentos), MAX(ultimo) FROM rollup WHERE categoria = ?{donde} '
+                        'GROUP BY cuenta, ip ORDER BY SUM(intentos) DESC, MIN(hora), cuenta, ip')
+            if top_k:
+                consulta += f' LIMIT {int(top_k)}'
+            for cuenta, ip, intentos, ultimo in self.conn.execute(consulta, (categoria, *parametros)):
+                resultado.contadores[categoria][(cuenta, ip)] = intentos
+                resultado.tiempos[categoria][(cuenta, ip)] = ultimo or "Fecha no encontrada"
+        return resultado
+
+    def exportar(self, path, desde=None, hasta=None):
+        # Filas horarias del rollup a CSV (por extensión) o JSON
+        donde, parametros = self.filtro(desde, hasta)
+        columnas = ('hora', 'categoria', 'cuenta', 'ip', 'intentos', 'ultimo')
+        filas = self.conn.execute(f'SELECT {", ".join(columnas)} FROM rollup WHERE 1 = 1{donde} '
+                                  'ORDER BY hora, categoria, cuenta, ip', parametros).fetchall()
+        with open(path, 'w', newline='') as f:
+            if path.lower().endswith('.csv'):
+                escritor = csv.writer(f)
+                escritor.writerow(columnas)
+                escritor.writerows(filas)
             else:
-                print("⚠️ No se encontraron datos.")
+                json.dump([dict(zip(columnas, fila)) for fila in filas], f, indent=4)
+        return len(filas)
+
+
+def actualizar_indice(indice, path):
+    # Suma al rollup lo añadido a mailbox.log desde la última posición (la ingesta detecta rotación
+    # y truncado). Devuelve la cantidad de intentos nuevos, o None si el rollup lo alimenta otro
+    # proceso: leer el log acá contaría dos veces lo que ese proceso ya sumó
+    if indice.alimentador():
+        return None
+    checkpoint = indice.cargar_checkpoint()
+    agregado = AgregadoHorario()
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    ingesta_reporte(agregado).seguir(path, checkpoint)
+    indice.confirmar(agregado, checkpoint)
+    return sum(intentos for intentos, _ in agregado.filas.values())
+
 
-        imprimir_resultados("Intentos fallidos por 'invalid password'", invalid_password, invalid_password_times)
-        imprimir_resultados("Intentos de 'account lockout'", account_lockout, account_lockout_times)
-        imprimir_resultados("Intentos con cuentas no existentes ('account not found')", account_not_found, account_not_found_times)
+# Mostrar resultados con la hora del último intento registrado
+def imprimir_resultados(titulo, contador, tiempos):
+    print(f"\n{titulo}:")
+    if contador:
+        for (correo, ip), cantidad in contador.most_common():
+            hora = tiempos.get((correo, ip), "Fecha no encontrada")
+            print(f"{CYAN}{correo} | {ip}{RESET} → {VIOLETA}{cantidad} intentos{RESET} (último intento: {GREEN}{hora}{RESET})")
+    else:
+        print("⚠️ No se encontraron datos.")
+
+
+# Top-K aproximado: cuenta estimada y el intervalo en el que está la real
+def imprimir_top_k(titulo, resumen, k):
+    print(f"\n{titulo} (top {k} aproximado sobre {resumen.total} intentos, error máximo {resumen.cota_error()}):")
+    if resumen:
+        for (correo, ip), cantidad in resumen.most_common(k):
+            hora = resumen.horas[(correo, ip)]
+            minimo = cantidad - resumen.errores[(correo, ip)]
+            rango = f"{cantidad} intentos" if minimo == cantidad else f"{minimo}-{cantidad} intentos"
+            print(f"{CYAN}{correo} | {ip}{RESET} → {VIOLETA}{rango}{RESET} (último intento: {GREEN}{hora}{RESET})")
+    else:
+        print("⚠️ No se encontraron datos.")
+
+
+def analizar_logs(path, procesos=1, top_k=None, desde=None, hasta=None):
+    # procesos > 1 reparte el archivo entre varios núcleos; el reporte es idéntico al de la pasada serial.
+    # top_k acota la memoria a K * FACTOR_CAPACIDAD_TOP_K claves por categoría (conteos aproximados).
+    # desde/hasta (marcas en bytes de parsear_instante) limitan el escaneo a ese tramo del archivo.
+    try:
+        inicio, fin = rango_temporal(path, desde, hasta)
+        if procesos > 1:
+            resultado = escanear_paralelo(path, procesos, top_k, inicio, fin)
+        else:
+            resultado = escanear_serial(path, top_k, inicio, fin)
+
+        for categoria, titulo in CATEGORIAS:
+            if top_k:
+                imprimir_top_k(titulo, resultado.contadores[categoria], top_k)
+            else:
+                imprimir_resultados(titulo, resultado.contadores[categoria], resultado.tiempos[categoria])
 
     except FileNotFoundError:
         print(f"Archivo no encontrado: {path}")
     except Exception as e:
         print(f"⚠️ Error al procesar el log: {e}")
 
-if __name__ == '__main__':
-    analizar_logs(LOG_PATH)
 
+def analizar_con_indice(path, indice_path, top_k=None, desde=None, hasta=None, exportar=None):
+    # Actualiza el rollup con lo nuevo del log y reporta (o exporta) desde él; los conteos son exactos
+    try:
+        indice = IndiceHorario(indice_path)
+        nuevos = actualizar_indice(indice, path)
+        if nuevos is None:
+            print(f"Índice {indice_path} alimentado por {indice.alimentador()}: no se relee {path}")
+        else:
+            print(f"Índice {indice_path} actualizado: {nuevos} intentos nuevos")
+        if exportar:
+            filas = indice.exportar(exportar, desde, hasta)
+            print(f"Exportadas {filas} filas horarias a {exportar}")
+            return
+        resultado = indice.resultado(desde, hasta, top_k)
+        for categoria, titulo in CATEGORIAS:
+            imprimir_resultados(titulo, resultado.contadores[categoria], resultado.tiempos[categoria])
+
+    except FileNotFoundError:
+        print(f"Archivo no encontrado: {path}")
+    except Exception as e:
+        print(f"⚠️ Error al procesar el log: {e}")
+
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser(description="Resume los fallos de autenticación de mailbox.log.")
+    argp.add_argument('log', nargs='?', default=LOG_PATH, help=f"ruta del log (por defecto {LOG_PATH})")
+    argp.add_argument('-p', '--procesos', type=int, default=1,
+                      help="procesos para escanear en paralelo (0 = uno por núcleo; por defecto 1, serial)")
+    argp.add_argument('-k', '--top-k', type=int,
+                      help="muestra sólo las K claves más frecuentes con memoria acotada (conteos aproximados)")
+    argp.add_argument('--desde', '--since', type=parsear_instante,
+                      help="sólo líneas desde este instante: 'AAAA-MM-DD HH:MM[:SS]' o antigüedad (90m, 1h, 2d)")
+    argp.add_argument('--hasta', '--until', type=parsear_instante,
+                      help="sólo líneas anteriores a este instante (mismo formato que --desde)")
+    argp.add_argument('--indice', nargs='?', const=INDICE_PATH, metavar='DB',
+                      help=f"actualiza el rollup horario en SQLite desde el último offset y reporta desde él "
+                           f"(por defecto {INDICE_PATH})")
+    argp.add_argument('--exportar', metavar='ARCHIVO',
+                      help="exporta las filas horarias del rollup (.csv o .json) en la ventana --desde/--hasta; implica --indice")
+    args = argp.parse_args()
+    if args.indice or args.exportar:
+        analizar_con_indice(args.log, args.indice or INDICE_PATH, args.top_k, args.desde, args.hasta, args.exportar)
+    else:
+        analizar_logs(args.log, args.procesos or os.cpu_count(), args.top_k, args.desde, args.hasta)
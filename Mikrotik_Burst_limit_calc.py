@@ -1,7 +1,30 @@
+import argparse
+import csv
+import json
+import math
+import sys
+from contextlib import nullcontext
+from functools import lru_cache
+
 from colorama import init, Fore, Style
 
+try:
+    import numpy as np  # Opcional: sólo lo necesita el modo lote (--lote)
+except ImportError:
+    np = None
+
 init(autoreset=True)
 
+MAX_LIMIT_POR_DEFECTO = 10  # max_limit (MB) del menú y de los planes sin columna max_limit
+
+# --- Búsqueda de parámetros (relativos a max_limit) ---
+RATIO_BURST_LIMIT = (1.25, 4.0)       # burst_limit entre 1.25 y 4 veces max_limit
+RATIO_BURST_THRESHOLD = (0.5, 0.95)   # burst_threshold por debajo de max_limit para que la ráfaga se corte
+RATIO_THRESHOLD_PREFERIDO = 0.75      # a igual error se prefiere el umbral más cercano a 3/4 de max_limit
+RANGO_BURST_TIME = (1, 120)           # burst_time entero en segundos
+PASO_RATIO = 0.05                     # resolución de la grilla de ratios
+TOLERANCIA_RAFAGA = 0.05              # error relativo admitido sobre la duración pedida
+
 
 class BurstCalculator:
     """
@@ -47,6 +70,463 @@ class BurstCalculator:
         tiempo_permitido = burst_time * burst_threshold / burst_limit
         return tiempo_permitido
 
+    @staticmethod
+    def errores_lote(max_limit, burst_limit, burst_threshold, burst_time):
+        """
+        Las reglas de validar_parametros aplicadas de una vez a arrays de NumPy
+        (una posición por plan, cada uno con su max_limit). Devuelve el mensaje
+        de error de cada plan, o '' si es válido.
+        """
+        no_numerico = ~(np.isfinite(max_limit) & np.isfinite(burst_limit)
+                        & np.isfinite(burst_threshold) & np.isfinite(burst_time))
+        reglas = [
+            (no_numerico, "faltan valores o no son numéricos."),
+            (burst_limit <= max_limit,
+             "burst_limit ({bl:g}) debe ser mayor que max_limit ({ml:g})."),
+            (burst_threshold <= 0,
+             "burst_threshold debe ser un valor positivo y mayor que cero."),
+            (burst_time <= 0,
+             "burst_time debe ser un entero positivo mayor que cero."),
+        ]
+        errores = [[] for _ in range(len(burst_limit))]
+        # Sólo se recorren en Python las filas que incumplen alguna regla
+        for mascara, mensaje in reglas:
+            for i in np.flatnonzero(mascara):
+                errores[i].append(mensaje.format(ml=max_limit[i], bl=burst_limit[i]))
+        return [' '.join(mensajes) for mensajes in errores]
+
+    @staticmethod
+    def calcular_lote(burst_time, burst_limit, burst_threshold):
+        """
+        calcular_burst_time y calcular_rafaga sobre arrays completos. Las filas
+        que errores_lote marca como inválidas dan inf/nan y deben descartarse.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tiempo_asignado = burst_time * burst_limit / burst_threshold
+            tiempo_permitido = burst_time * burst_threshold / burst_limit
+        return tiempo_asignado, tiempo_permitido
+
+
+class SimuladorBurst:
+    """
+    Simulación de la lógica de burst de RouterOS sobre trazas de tráfico,
+    para muchas colas a la vez (una posición por cola en cada array).
+    El promedio se mide sobre la ventana de burst_time dividida en 16
+    subventanas y sólo se reevalúa al cerrar cada subventana: mientras el
+    promedio esté por debajo de burst_threshold la cola deja pasar hasta
+    burst_limit, si no, hasta max_limit. El tráfico que excede el límite
+    se descarta (no se encola).
+    """
+
+    SUBVENTANAS = 16
+
+    def __init__(self, max_limit, burst_limit, burst_threshold, burst_time, paso=1.0):
+        self.max_limit = np.asarray(max_limit, dtype=float)
+        self.burst_limit = np.asarray(burst_limit, dtype=float)
+        self.burst_threshold = np.asarray(burst_threshold, dtype=float)
+        self.burst_time = np.asarray(burst_time, dtype=float)
+        self.paso = paso  # segundos por muestra de la traza (1 o 0.1)
+
+    def subventanas(self):
+        """
+        Muestras de la ventana (burst_time) y cantidad de subventanas de
+        cada cola. La subventana k cierra en la muestra k×ventana/16 (piso),
+        así la ventana dura burst_time aunque no sea múltiplo de 16
+        muestras. Con muestras más largas que burst_time/16 cada muestra es
+        una subventana y hay menos de 16 (la resolución la pone la traza).
+        """
+        ventana = np.maximum(1, np.rint(self.burst_time / self.paso)).astype(int)
+        cantidad = np.minimum(self.SUBVENTANAS, ventana)
+        return ventana, cantidad
+
+    def simular(self, demanda):
+        """
+        Reproduce la demanda (Mbps, matriz colas × muestras) y devuelve por
+        cola, en segundos salvo los bytes: tiempo total en ráfaga (por encima
+        de max_limit), ráfaga continua más larga, tiempo limitado (demanda
+        por encima del límite vigente) y bytes entregados.
+        """
+        demanda = np.nan_to_num(np.asarray(demanda, dtype=float))
+        colas, muestras = demanda.shape
+        # Muestras × colas contiguo: cada paso lee una fila seguida
+        demanda = np.ascontiguousarray(demanda.T)
+        ventana, cantidad = self.subventanas()
+        anillo = np.zeros((colas, self.SUBVENTANAS))  # Mbps sumados por subventana
+        suma = np.zeros(colas)                        # suma de las subventanas de la ventana
+        acumulado = np.zeros(colas)                   # subventana en curso
+        pasos = np.zeros(colas, dtype=int)            # muestras desde que empezó la vuelta a la ventana
+        posicion = np.zeros(colas, dtype=int)
+        cierre_siguiente = ventana // cantidad        # muestra en que cierra la subventana en curso
+        permitido = np.ones(colas, dtype=bool)        # la cola arranca sin historial
+        divisor = ventana.astype(float)
+
+        entregado_total = np.zeros(colas)
+        en_rafaga = np.zeros(colas, dtype=int)
+        limitado = np.zeros(colas, dtype=int)
+        racha = np.zeros(colas, dtype=int)
+        racha_max = np.zeros(colas, dtype=int)
+        filas = np.arange(colas)
+
+        # El bucle es sobre el tiempo; cada paso opera sobre todas las colas
+        for t in range(muestras):
+            tasa = demanda[t]
+            limite = np.where(permitido, self.burst_limit, self.max_limit)
+            entregado = np.minimum(tasa, limite)
+            entregado_total += entregado
+            limitado += tasa > limite
+            rafaga = entregado > self.max_limit
+            en_rafaga += rafaga
+            racha += 1
+            racha *= rafaga
+            np.maximum(racha_max, racha, out=racha_max)
+
+            acumulado += entregado
+            pasos += 1
+            cierre = pasos == cierre_siguiente
+            if cierre.any():
+                q = filas[cierre]
+                p = posicion[q]
+                suma[q] += acumulado[q] - anillo[q, p]
+                anillo[q, p] = acumulado[q]
+                p = (p + 1) % cantidad[q]
+                posicion[q] = p
+                pasos[q] *= p != 0  # Vuelta completa a la ventana
+                cierre_siguiente[q] = (p + 1) * ventana[q] // cantidad[q]
+                acumulado[q] = 0
+                permitido[q] = suma[q] / divisor[q] < self.burst_threshold[q]
+
+        return {
+            'rafaga_total': en_rafaga * self.paso,
+            'rafaga_max': racha_max * self.paso,
+            'limitado': limitado * self.paso,
+            'bytes_entregados': entregado_total * self.paso * 1e6 / 8,
+        }
+
+
+@lru_cache(maxsize=256)
+def candidatos_por_ratio(objetivo, ratio_limit, ratio_threshold, rango_burst_time, paso_ratio):
+    """
+    Grilla de combinaciones (burst_limit/max_limit, burst_threshold/max_limit,
+    burst_time) cercanas a la duración objetivo. tiempo_permitido =
+    burst_time × burst_threshold / burst_limit no depende de max_limit, así
+    que la grilla vale para todos los planes con el mismo objetivo y queda
+    memoizada entre niveles de plan.
+    """
+    limites = np.round(np.arange(ratio_limit[0], ratio_limit[1] + paso_ratio / 2, paso_ratio), 6)
+    umbrales = np.round(np.arange(ratio_threshold[0], ratio_threshold[1] + paso_ratio / 2, paso_ratio), 6)
+    rl, rt = (m.ravel() for m in np.meshgrid(limites, umbrales, indexing='ij'))
+    # Poda analítica: burst_time se despeja de la fórmula y sólo se prueban
+    # los dos enteros vecinos al ideal, no todo el rango
+    ideal = objetivo * rl / rt
+    bt = np.concatenate([np.floor(ideal), np.ceil(ideal)])
+    rl, rt = np.tile(rl, 2), np.tile(rt, 2)
+    dentro = (bt >= rango_burst_time[0]) & (bt <= rango_burst_time[1]) & (rt < rl)
+    candidatos = np.unique(np.column_stack([rl, rt, bt])[dentro], axis=0)
+    candidatos.setflags(write=False)  # compartido por todas las llamadas
+    return candidatos
+
+
+@lru_cache(maxsize=4096)
+def combinaciones_por_plan(max_limit, objetivo, ratio_limit, ratio_threshold, rango_burst_time,
+                           paso_ratio, tolerancia, resolucion):
+    """
+    Todas las combinaciones factibles de un nivel de plan, ya ordenadas
+    (filas burst_limit, burst_threshold, burst_time, tiempo_permitido, error).
+    Memoizada: en un catálogo los niveles (max_limit, objetivo) se repiten.
+    """
+    candidatos = candidatos_por_ratio(objetivo, ratio_limit, ratio_threshold,
+                                      rango_burst_time, paso_ratio)
+    # Los valores reales se redondean, así que el tiempo se recalcula después de escalar
+    escala = max_limit / resolucion
+    bl = np.round(np.round(candidatos[:, 0] * escala) * resolucion, 6)
+    bth = np.round(np.round(candidatos[:, 1] * escala) * resolucion, 6)
+    bt = candidatos[:, 2]
+    _, permitido = BurstCalculator.calcular_lote(bt, bl, bth)
+    error = np.abs(permitido - objetivo) / objetivo
+    # El redondeo puede sacar un valor de sus restricciones (p.ej. burst_threshold igual a max_limit):
+    # se vuelven a comprobar sobre los valores finales
+    margen = 1e-9
+    ratio_bl, ratio_bth = bl / max_limit, bth / max_limit
+    validos = ((bl > max_limit) & (bth > 0) & (bth < max_limit) & (error <= tolerancia)
+               & (ratio_bl >= ratio_limit[0] - margen) & (ratio_bl <= ratio_limit[1] + margen)
+               & (ratio_bth >= ratio_threshold[0] - margen) & (ratio_bth <= ratio_threshold[1] + margen))
+    filas = np.column_stack([bl, bth, bt, permitido, error])[validos]
+    preferencia = np.abs(filas[:, 1] / max_limit - RATIO_THRESHOLD_PREFERIDO)
+    ordenadas = filas[np.lexsort((filas[:, 0], filas[:, 1], filas[:, 2],
+                                  np.round(preferencia, 6), np.round(filas[:, 4], 9)))]
+    # El redondeo junta ratios vecinos en el mismo valor: quedan consecutivas tras ordenar
+    repetidas = np.zeros(len(ordenadas), dtype=bool)
+    repetidas[1:] = (ordenadas[1:, :3] == ordenadas[:-1, :3]).all(axis=1)
+    ordenadas = ordenadas[~repetidas]
+    ordenadas.setflags(write=False)
+    return ordenadas
+
+
+class BuscadorBurst:
+    """
+    Búsqueda de burst_limit, burst_threshold y burst_time que den una
+    duración de ráfaga (tiempo_permitido) deseada, dentro de las
+    restricciones dadas como ratios sobre max_limit.
+    """
+
+    def __init__(self, ratio_limit=RATIO_BURST_LIMIT, ratio_threshold=RATIO_BURST_THRESHOLD,
+                 rango_burst_time=RANGO_BURST_TIME, paso_ratio=PASO_RATIO,
+                 tolerancia=TOLERANCIA_RAFAGA, resolucion=None):
+        self.ratio_limit = tuple(ratio_limit)
+        self.ratio_threshold = tuple(ratio_threshold)
+        self.rango_burst_time = tuple(rango_burst_time)
+        self.paso_ratio = paso_ratio
+        self.tolerancia = tolerancia
+        self.resolucion = resolucion  # redondeo (MB) de burst_limit y burst_threshold; None = automático
+
+    @staticmethod
+    def resolucion_para(max_limit):
+        # MB enteros desde 1 MB; debajo, la potencia de diez del plan (0.5 MB -> 0.1 MB)
+        return min(1.0, 10.0 ** math.floor(math.log10(max_limit)))
+
+    def resolver(self, max_limit, objetivo, cantidad=5):
+        """
+        Hasta `cantidad` combinaciones factibles para un plan, de menor a mayor
+        error relativo; a igual error, umbral más cercano al preferido y
+        burst_time más corto. Lista vacía si ninguna entra en la tolerancia.
+        """
+        if max_limit <= 0 or objetivo <= 0:
+            raise ValueError("max_limit y la duración objetivo deben ser mayores que cero.")
+        soluciones = combinaciones_por_plan(
+            float(max_limit), float(objetivo), self.ratio_limit, self.ratio_threshold,
+            self.rango_burst_time, self.paso_ratio, self.tolerancia,
+            self.resolucion or self.resolucion_para(max_limit))
+        return [{
+            'burst_limit': valor_salida(bl, None),
+            'burst_threshold': valor_salida(bth, None),
+            'burst_time': valor_salida(bt, None),
+            'tiempo_permitido': round(float(permitido), 2),
+            'error': round(float(error), 4),
+        } for bl, bth, bt, permitido, error in soluciones[:cantidad]]
+
+    def resolver_catalogo(self, max_limits, objetivos):
+        """
+        La mejor combinación de cada plan (None si no tiene solución). Los
+        planes que comparten objetivo reutilizan la misma grilla memoizada.
+        """
+        mejores = []
+        for max_limit, objetivo in zip(max_limits, objetivos):
+            soluciones = self.resolver(max_limit, objetivo, cantidad=1)
+            mejores.append(soluciones[0] if soluciones else None)
+        return mejores
+
+
+def leer_planes(path):
+    """
+    Lee los planes de un CSV con cabecera o de un JSON (lista de objetos).
+    Columnas: nombre, target y max_limit (opcionales), burst_limit,
+    burst_threshold y burst_time.
+    """
+    with open(path, newline='') as f:
+        if path.lower().endswith('.json'):
+            return json.load(f)
+        return list(csv.DictReader(f))
+
+
+def a_float(valor, defecto=math.nan):
+    if valor is None or valor == '':
+        return defecto
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def valor_salida(numero, crudo):
+    # Valor usado en el cálculo; si no se pudo leer, el que venía en el archivo
+    if not math.isfinite(numero):
+        return crudo
+    return int(numero) if float(numero).is_integer() else float(numero)
+
+
+def columna(planes, clave, defecto=math.nan):
+    """
+    Columna numérica de los planes como array float; los vacíos toman el
+    valor por defecto y los textos no numéricos quedan como NaN.
+    """
+    valores = [defecto if plan.get(clave) in (None, '') else plan[clave]
+               for plan in planes]
+    try:
+        return np.array(valores, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([a_float(valor) for valor in valores], dtype=float)
+
+
+def comando_queue(nombre, target, ml, bl, bth, bt, tiempo_permitido):
+    # Cola simple simétrica (subida/bajada) con los límites en Mbps
+    partes = [f'/queue simple add name="{nombre}"']
+    if target:
+        partes.append(f'target={target}')
+    partes += [f'max-limit={ml:g}M/{ml:g}M', f'burst-limit={bl:g}M/{bl:g}M',
+               f'burst-threshold={bth:g}M/{bth:g}M', f'burst-time={bt:g}s/{bt:g}s',
+               f'comment="rafaga {tiempo_permitido:.2f}s"']
+    return ' '.join(partes)
+
+
+def cargar_planes(path, max_limit=MAX_LIMIT_POR_DEFECTO):
+    """
+    Lee y valida los planes: devuelve los planes crudos, sus nombres, las
+    columnas numéricas (max_limit, burst_limit, burst_threshold, burst_time)
+    y el mensaje de error de cada uno ('' si es válido).
+    """
+    planes = leer_planes(path)
+    ml = columna(planes, 'max_limit', max_limit)
+    bl = columna(planes, 'burst_limit')
+    bth = columna(planes, 'burst_threshold')
+    bt = columna(planes, 'burst_time')
+    errores = BurstCalculator.errores_lote(ml, bl, bth, bt)
+    nombres = [plan.get('nombre') or f"plan{i + 1}" for i, plan in enumerate(planes)]
+    return planes, nombres, (ml, bl, bth, bt), errores
+
+
+def escribir_filas(filas, salida, formato):
+    if formato == 'json':
+        json.dump(list(filas), salida, indent=4, ensure_ascii=False)
+        salida.write('\n')
+    else:
+        escritor = None
+        for fila in filas:
+            if escritor is None:
+                escritor = csv.DictWriter(salida, fieldnames=list(fila))
+                escritor.writeheader()
+            escritor.writerow(fila)
+
+
+def procesar_lote(path, salida, formato='csv', max_limit=MAX_LIMIT_POR_DEFECTO):
+    """
+    Modo lote: valida y calcula todos los planes con NumPy y escribe los
+    resultados (csv/json) o los comandos /queue simple de RouterOS.
+    Devuelve la cantidad de planes inválidos.
+    """
+    planes, nombres, (ml, bl, bth, bt), errores = cargar_planes(path, max_limit)
+    asignado, permitido = BurstCalculator.calcular_lote(bt, bl, bth)
+
+    if formato == 'routeros':
+        # Los planes inválidos quedan como comentario: el script sigue siendo importable
+        for i, nombre in enumerate(nombres):
+            if errores[i]:
+                salida.write(f"# {nombre}: {errores[i]}\n")
+            else:
+                salida.write(comando_queue(nombre, planes[i].get('target'), ml[i], bl[i],
+                                           bth[i], bt[i], permitido[i]) + '\n')
+    else:
+        escribir_filas(({
+            'nombre': nombre,
+            'max_limit': valor_salida(ml[i], planes[i].get('max_limit')),
+            'burst_limit': valor_salida(bl[i], planes[i].get('burst_limit')),
+            'burst_threshold': valor_salida(bth[i], planes[i].get('burst_threshold')),
+            'burst_time': valor_salida(bt[i], planes[i].get('burst_time')),
+            'tiempo_asignado': None if errores[i] else round(float(asignado[i]), 2),
+            'tiempo_permitido': None if errores[i] else round(float(permitido[i]), 2),
+            'error': errores[i],
+        } for i, nombre in enumerate(nombres)), salida, formato)
+    return sum(1 for error in errores if error)
+
+
+def leer_traza(path, nombres):
+    """
+    Traza de demanda en Mbps como matriz colas × muestras, en el orden de
+    los planes. CSV: una columna por plan (cabecera con su nombre) y una
+    fila por muestra. .npy: la matriz tal cual, una fila por plan.
+    """
+    if path.lower().endswith('.npy'):
+        traza = np.load(path)
+        if traza.ndim != 2 or traza.shape[0] != len(nombres):
+            raise ValueError(f"la traza debe tener una fila por plan ({len(nombres)}), tiene forma {traza.shape}")
+        return traza
+    with open(path, newline='') as f:
+        cabecera = [nombre.strip() for nombre in f.readline().rstrip('\r\n').split(',')]
+        datos = np.loadtxt(f, delimiter=',', ndmin=2)
+    columnas = {nombre: i for i, nombre in enumerate(cabecera)}
+    faltan = [nombre for nombre in nombres if nombre not in columnas]
+    if faltan:
+        raise ValueError(f"la traza no tiene columna para: {', '.join(faltan)}")
+    return datos[:, [columnas[nombre] for nombre in nombres]].T
+
+
+def procesar_simulacion(path, path_traza, salida, formato='csv',
+                        max_limit=MAX_LIMIT_POR_DEFECTO, paso=1.0):
+    """
+    Reproduce la traza contra cada plan válido con SimuladorBurst y escribe
+    por cola el tiempo en ráfaga, el tiempo limitado y lo entregado, junto
+    al tiempo_permitido teórico para comparar. Devuelve los planes inválidos.
+    """
+    planes, nombres, (ml, bl, bth, bt), errores = cargar_planes(path, max_limit)
+    validos = np.array([not error for error in errores], dtype=bool)
+    traza = leer_traza(path_traza, nombres)
+    _, permitido = BurstCalculator.calcular_lote(bt, bl, bth)
+    simulador = SimuladorBurst(ml[validos], bl[validos], bth[validos], bt[validos], paso)
+    resultado = simulador.simular(traza[validos])
+    # Posición de cada plan válido dentro de los arrays del resultado
+    indice = np.cumsum(validos) - 1
+
+    def fila(i, nombre):
+        datos = {'nombre': nombre, 'tiempo_permitido': None, 'rafaga_total': None,
+                 'rafaga_max': None, 'limitado': None, 'mb_entregados': None,
+                 'error': errores[i]}
+        if not errores[i]:
+            j = indice[i]
+            datos.update(
+                tiempo_permitido=round(float(permitido[i]), 2),
+                rafaga_total=round(float(resultado['rafaga_total'][j]), 2),
+                rafaga_max=round(float(resultado['rafaga_max'][j]), 2),
+                limitado=round(float(resultado['limitado'][j]), 2),
+                mb_entregados=round(float(resultado['bytes_entregados'][j]) / 1e6, 3))
+        return datos
+
+    escribir_filas((fila(i, nombre) for i, nombre in enumerate(nombres)), salida, formato)
+    return int((~validos).sum())
+
+
+def procesar_catalogo(path, salida, formato='csv', max_limit=MAX_LIMIT_POR_DEFECTO,
+                      buscador=None):
+    """
+    Regenera los parámetros de burst de todo el catálogo: cada plan trae su
+    max_limit y la duración de ráfaga deseada (rafaga_objetivo, segundos).
+    Escribe la mejor combinación en csv/json o como /queue simple.
+    Devuelve la cantidad de planes sin solución.
+    """
+    buscador = buscador or BuscadorBurst()
+    planes = leer_planes(path)
+    ml = columna(planes, 'max_limit', max_limit)
+    objetivo = columna(planes, 'rafaga_objetivo')
+    nombres = [plan.get('nombre') or f"plan{i + 1}" for i, plan in enumerate(planes)]
+    validos = np.isfinite(ml) & np.isfinite(objetivo) & (ml > 0) & (objetivo > 0)
+    mejores = [None] * len(planes)
+    for i, mejor in zip(np.flatnonzero(validos),
+                        buscador.resolver_catalogo(ml[validos], objetivo[validos])):
+        mejores[i] = mejor
+    errores = ['' if mejores[i] else
+               "sin combinación dentro de la tolerancia y las restricciones." if validos[i] else
+               "max_limit y rafaga_objetivo deben ser números mayores que cero."
+               for i in range(len(planes))]
+
+    if formato == 'routeros':
+        for i, nombre in enumerate(nombres):
+            mejor = mejores[i]
+            if mejor is None:
+                salida.write(f"# {nombre}: {errores[i]}\n")
+            else:
+                salida.write(comando_queue(nombre, planes[i].get('target'), ml[i],
+                                           mejor['burst_limit'], mejor['burst_threshold'],
+                                           mejor['burst_time'], mejor['tiempo_permitido']) + '\n')
+    else:
+        vacio = dict.fromkeys(('burst_limit', 'burst_threshold', 'burst_time', 'tiempo_permitido'))
+        escribir_filas(({
+            'nombre': nombre,
+            'max_limit': valor_salida(ml[i], planes[i].get('max_limit')),
+            'rafaga_objetivo': valor_salida(objetivo[i], planes[i].get('rafaga_objetivo')),
+            **{clave: valor for clave, valor in (mejores[i] or vacio).items() if clave != 'error'},
+            'desvio': mejores[i]['error'] if mejores[i] else None,
+            'error': errores[i],
+        } for i, nombre in enumerate(nombres)), salida, formato)
+    return sum(1 for error in errores if error)
+
 
 def solicitar_int(mensaje):
     """
@@ -115,7 +595,7 @@ def mostrar_explicacion_rafaga():
 
 
 def menu():
-    max_limit = 10  # Este valor puede ser parametrizado o ingresado en otro módulo
+    max_limit = MAX_LIMIT_POR_DEFECTO  # En modo lote cada plan puede traer el suyo
 
     burst_calculator = BurstCalculator(max_limit=max_limit)
 
@@ -126,16 +606,17 @@ def menu():
         print("2) Cálculo preciso del tiempo permitido para ráfaga")
         print("3) Exposición técnica sobre burst_time")
         print("4) Explicación analítica del cálculo de ráfaga")
-        print("5) Salir del sistema\n")
+        print("5) Buscar parámetros para una duración de ráfaga")
+        print("6) Salir del sistema\n")
 
-        opcion = input(Fore.GREEN + "Seleccione una opción (1-5): ").strip()
+        opcion = input(Fore.GREEN + "Seleccione una opción (1-6): ").strip()
 
         if opcion == '1':
             try:
                 burst_time = solicitar_int(
                     "Ingrese el tiempo inicial (burst_time) en segundos: ")
                 burst_limit = solicitar_int(
-                    "Ingrese el burst_limit (MB), debe ser mayor que max_limit (10 MB): ")
+                    f"Ingrese el burst_limit (MB), debe ser mayor que max_limit ({max_limit} MB): ")
                 burst_threshold = solicitar_int(
                     "Ingrese el burst_threshold (MB): ")
 
@@ -183,11 +664,91 @@ def menu():
             mostrar_explicacion_rafaga()
 
         elif opcion == '5':
+            if np is None:
+                print(Fore.RED + "La búsqueda de parámetros requiere numpy: pip install numpy")
+                continue
+            try:
+                objetivo = solicitar_int(
+                    "Ingrese la duración de ráfaga deseada (segundos): ")
+                soluciones = BuscadorBurst().resolver(max_limit, objetivo)
+                if not soluciones:
+                    print(Fore.RED + "Ninguna combinación entra en la tolerancia.")
+                    continue
+
+                print(Fore.GREEN + Style.BRIGHT +
+                      f"\n--- Combinaciones para {objetivo} s con max_limit {max_limit} MB ---")
+                for solucion in soluciones:
+                    print(f"burst_limit: {solucion['burst_limit']} MB, "
+                          f"burst_threshold: {solucion['burst_threshold']} MB, "
+                          f"burst_time: {solucion['burst_time']} s -> "
+                          f"{solucion['tiempo_permitido']:.2f} segundos")
+                print()
+
+            except Exception as e:
+                print(Fore.RED + f"Error en cálculo: {e}")
+
+        elif opcion == '6':
             print(Fore.CYAN + "Terminando ejecución. Gracias por utilizar el sistema.")
             break
         else:
-            print(Fore.RED + "Opción inválida. Seleccione un número entre 1 y 5.")
+            print(Fore.RED + "Opción inválida. Seleccione un número entre 1 y 6.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cálculos de burst para colas simples de MikroTik. "
+                    "Sin argumentos abre el menú interactivo.")
+    parser.add_argument('--lote', metavar='PLANES',
+                        help="CSV o JSON de planes a validar y calcular de una vez (requiere numpy)")
+    parser.add_argument('--formato', choices=('csv', 'json', 'routeros'), default='csv',
+                        help="salida del modo lote: resultados en csv/json o comandos /queue simple")
+    parser.add_argument('--salida', metavar='ARCHIVO',
+                        help="archivo de salida del modo lote (por defecto, la salida estándar)")
+    parser.add_argument('--simular', metavar='TRAZA',
+                        help="con --lote, reproduce una traza de demanda en Mbps (CSV con una "
+                             "columna por plan o .npy colas × muestras) contra cada plan")
+    parser.add_argument('--paso', type=float, default=1.0,
+                        help="segundos por muestra de la traza (1 o 0.1; por defecto 1)")
+    parser.add_argument('--resolver', action='store_true',
+                        help="con --lote, busca burst_limit/threshold/time para la columna "
+                             "rafaga_objetivo (segundos) de cada plan del catálogo")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_RAFAGA,
+                        help=f"error relativo admitido por --resolver (por defecto {TOLERANCIA_RAFAGA})")
+    parser.add_argument('--resolucion', type=float,
+                        help="redondeo (MB) de burst_limit y burst_threshold en --resolver "
+                             "(por defecto 1, o menos en planes de menos de 1 MB)")
+    parser.add_argument('--max-limit', type=float, default=MAX_LIMIT_POR_DEFECTO,
+                        help=f"max_limit de los planes sin columna max_limit (por defecto {MAX_LIMIT_POR_DEFECTO})")
+    args = parser.parse_args()
+
+    if not args.lote:
+        menu()
+        return
+    if np is None:
+        sys.exit("El modo lote requiere numpy: pip install numpy")
+    if args.simular and args.formato == 'routeros':
+        parser.error("la simulación sólo escribe csv o json")
+    if args.paso <= 0:
+        parser.error("--paso debe ser mayor que cero")
+    if args.simular and args.resolver:
+        parser.error("--simular y --resolver no se combinan")
+    if args.resolucion is not None and args.resolucion <= 0:
+        parser.error("--resolucion debe ser mayor que cero")
+    destino = open(args.salida, 'w', newline='') if args.salida else nullcontext(sys.stdout)
+    with destino as salida:
+        if args.simular:
+            invalidos = procesar_simulacion(args.lote, args.simular, salida, args.formato,
+                                            args.max_limit, args.paso)
+        elif args.resolver:
+            invalidos = procesar_catalogo(args.lote, salida, args.formato, args.max_limit,
+                                          BuscadorBurst(tolerancia=args.tolerancia,
+                                                        resolucion=args.resolucion))
+        else:
+            invalidos = procesar_lote(args.lote, salida, args.formato, args.max_limit)
+    if invalidos:
+        print(Fore.RED + f"{invalidos} planes con errores de validación.", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    menu()
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los parsers de log sobre archivos sintéticos (o reales, con --maillog / --mailbox-log).
+- maillog: recorrido original (regex anclada + strptime por coincidencia) contra ParserSyslog.
+- mailbox.log: bucle original (lower() + regex sin acotar por línea) contra el detector sobre bytes.
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import Mailbox_zimbra_Logger as analizador
+import zimbra_log_ingest as ingesta
+
+# --- Generación de maillog sintético ---
+PLANTILLAS_MAILLOG = [
+    "{ts} mail postfix/smtpd[{pid}]: connect from unknown[{ip}]",
+    "{ts} mail postfix/smtpd[{pid}]: disconnect from unknown[{ip}] ehlo=1 auth=0/1 quit=1 commands=2/3",
+    "{ts} mail postfix/qmgr[{pid}]: 4F1A22C0F1B: from=<noreply@example.com>, size=2310, nrcpt=1 (queue active)",
+    "{ts} mail postfix/smtp[{pid}]: 4F1A22C0F1B: to=<user@example.org>, relay=mx.example.org[{ip}]:25, delay=0.4, status=sent (250 OK)",
+    "{ts} mail postfix/cleanup[{pid}]: 4F1A22C0F1B: message-id=<20241017100102.4F1A22C0F1B@mail.example.com>",
+]
+PLANTILLA_FALLO_SASL = ("{ts} mail postfix/smtpd[{pid}]: warning: unknown[{ip}]: "
+                        "SASL LOGIN authentication failed: UGFzc3dvcmQ6")
+
+
+def ip_aleatoria(rnd):
+    return f"{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}"
+
+
+def generar_maillog(path, tamano_mb, proporcion_fallos=0.05, semilla=1):
+    # Escribe líneas cronológicas hasta alcanzar el tamaño pedido
+    rnd = random.Random(semilla)
+    atacantes = [ip_aleatoria(rnd) for _ in range(5000)]
+    instante = datetime.now() - timedelta(days=1)
+    objetivo = tamano_mb * 1024 * 1024
+    escrito = 0
+    with open(path, 'w') as f:
+        while escrito < objetivo:
+            bloque = []
+            for _ in range(10000):
+                instante += timedelta(milliseconds=rnd.randint(0, 40))
+                ts = instante.strftime('%b %e %H:%M:%S')
+                if rnd.random() < proporcion_fallos:
+                    linea = PLANTILLA_FALLO_SASL.format(ts=ts, pid=rnd.randint(1000, 99999), ip=rnd.choice(atacantes))
+                else:
+                    linea = rnd.choice(PLANTILLAS_MAILLOG).format(ts=ts, pid=rnd.randint(1000, 99999), ip=ip_aleatoria(rnd))
+                bloque.append(linea)
+            texto = '\n'.join(bloque) + '\n'
+            f.write(texto)
+            escrito += len(texto)
+
+
+# --- Generación de mailbox.log sintético ---
+PLANTILLAS_MAILBOX = [
+    "{ts} INFO  [qtp1-{n}:https://mail.example.com/service/soap/GetInfoRequest] [name={correo};mid=12;ip={ip};ua=ZimbraWebClient;] soap - GetInfoRequest elapsed=3",
+    "{ts} INFO  [ImapServer-{n}] [name={correo};ip={ip};ua=Thunderbird;] imap - SELECT elapsed=1",
+    "{ts} INFO  [LmtpServer-{n}] [name={correo};mid=40;] lmtp - Delivering message: size=5120 bytes",
+]
+PLANTILLAS_FALLO_MAILBOX = [
+    "{ts} INFO  [qtp1-{n}:https://mail.example.com/service/soap/AuthRequest] [name={correo};oip={ip};ua=zclient/9.0;] account - authentication failed for [{correo}] (invalid password)",
+    "{ts} WARN  [ImapServer-{n}] [name={correo};oip={ip};ua=Outlook;] security - cmd=Auth; account={correo}; error=authentication failed for [{correo}], account lockout;",
+    "{ts} INFO  [qtp1-{n}] [ip={ip};ua=curl/7.61;] account - Authentication failed for [{correo}], account not found",
+]
+
+
+def generar_mailbox_log(path, tamano_mb, proporcion_fallos=0.01, semilla=1):
+    rnd = random.Random(semilla)
+    cuentas = [f"user{i}@example.com" for i in range(2000)]
+    atacantes = [ip_aleatoria(rnd) for _ in range(5000)]
+    instante = datetime.now() - timedelta(days=1)
+    objetivo = tamano_mb * 1024 * 1024
+    escrito = 0
+    with open(path, 'w') as f:
+        while escrito < objetivo:
+            bloque = []
+            for n in range(10000):
+                instante += timedelta(milliseconds=rnd.randint(0, 20))
+                ts = instante.strftime('%Y-%m-%d %H:%M:%S,') + f"{instante.microsecond // 1000:03d}"
+                if rnd.random() < proporcion_fallos:
+                    plantilla, ip = rnd.choice(PLANTILLAS_FALLO_MAILBOX), rnd.choice(atacantes)
+                else:
+                    plantilla, ip = rnd.choice(PLANTILLAS_MAILBOX), ip_aleatoria(rnd)
+                bloque.append(plantilla.format(ts=ts, n=n, correo=rnd.choice(cuentas), ip=ip))
+            texto = '\n'.join(bloque) + '\n'
+            f.write(texto)
+            escrito += len(texto)
+
+
+# --- Parsers comparados ---
+def maillog_original(path):
+    # Recorrido de la versión original: regex anclada con .*? y strptime por cada coincidencia
+    current_year = datetime.now().year
+    intentos = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = ingesta.log_pattern.search(line)
+            if match:
+                month = ingesta.month_map[match.group('month')]
+                day = int(match.group('day'))
+                datetime.strptime(f"{current_year}-{month}-{day} {match.group('time')}", "%Y-%m-%d %H:%M:%S")
+                intentos += 1
+    return intentos
+
+
+def maillog_parser_syslog(path):
+    parseador = ingesta.ParserSyslog()
+    intentos = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if parseador.parsear(line):
+                intentos += 1
+    return intentos
+
+
+# Regex de la versión original de Mailbox_zimbra_Logger.py, tal cual (con los '.*?' sin acotar)
+regex_datetime_original = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})')
+regex_general_original = re.compile(r'\[name=([^;\]]+).*?oip=(\d+\.\d+\.\d+\.\d+)', re.IGNORECASE)
+regex_account_not_found_original = re.compile(r'authentication failed for \[([^\]]+)\]', re.IGNORECASE)
+regex_ip_original = re.compile(r'\[(?:oip|ip)=(\d+\.\d+\.\d+\.\d+)', re.IGNORECASE)
+
+
+def mailbox_original(path):
+    # Bucle de la versión original: lower() de cada línea y regex por separado
+    contadores = {'invalid_password': Counter(), 'account_lockout': Counter(), 'account_not_found': Counter()}
+    tiempos = {categoria: {} for categoria in contadores}
+    with open(path, 'r') as f:
+        for linea in f:
+            linea_lower = linea.lower()
+            if 'authentication failed' in linea_lower:
+                dt_match = regex_datetime_original.search(linea)
+                datetime_str = dt_match.group(1) if dt_match else "Fecha no encontrada"
+
+                if 'invalid password' in linea_lower or 'account lockout' in linea_lower:
+                    match = regex_general_original.search(linea)
+                    if match:
+                        clave = f"{match.group(1).strip()} | {match.group(2).strip()}"
+                        categoria = 'invalid_password' if 'invalid password' in linea_lower else 'account_lockout'
+                        contadores[categoria][clave] += 1
+                        tiempos[categoria][clave] = datetime_str
+
+                elif 'account not found' in linea_lower:
+                    match_correo = regex_account_not_found_original.search(linea)
+                    match_ip = regex_ip_original.search(linea)
+                    if match_correo:
+                        ip_nf = match_ip.group(1).strip() if match_ip else "IP no encontrada"
+                        clave_nf = f"{match_correo.group(1).strip()} | {ip_nf}"
+                        contadores['account_not_found'][clave_nf] += 1
+                        tiempos['account_not_found'][clave_nf] = datetime_str
+    return sum(sum(c.values()) for c in contadores.values())
+
+
+def mailbox_bytes(path):
+    resultado = analizador.escanear_serial(path)
+    return sum(sum(c.values()) for c in resultado.contadores.values())
+
+
+def medir(nombre, funcion, path):
+    inicio = time.perf_counter()
+    resultado = funcion(path)
+    segundos = time.perf_counter() - inicio
+    mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"{nombre:<28} {segundos:8.2f} s  {mb / segundos:8.1f} MB/s  ({resultado} coincidencias)")
+    return segundos
+
+
+def comparar(titulo, path, original, nuevo):
+    print(f"\n=== {titulo}: {path} ===")
+    t_original = medir("original", original, path)
+    t_nuevo = medir("nuevo", nuevo, path)
+    print(f"Aceleración: x{t_original / t_nuevo:.1f}")
+
+
+def main():
+    argp = argparse.ArgumentParser(description="Benchmark de los parsers de log.")
+    argp.add_argument('--maillog', help="maillog existente (si no, se genera uno sintético)")
+    argp.add_argument('--mailbox-log', help="mailbox.log existente (si no, se genera uno sintético)")
+    argp.add_argument('--tamano-mb', type=int, default=1024, help="tamaño de cada log sintético (por defecto 1024 MB)")
+    args = argp.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        maillog = args.maillog
+        if not maillog:
+            maillog = os.path.join(tmp, 'maillog')
+            print(f"Generando maillog sintético de {args.tamano_mb} MB...")
+            generar_maillog(maillog, args.tamano_mb)
+        comparar("maillog (fallos SASL)", maillog, maillog_original, maillog_parser_syslog)
+
+        mailbox_log = args.mailbox_log
+        if not mailbox_log:
+            mailbox_log = os.path.join(tmp, 'mailbox.log')
+            print(f"\nGenerando mailbox.log sintético de {args.tamano_mb} MB...")
+            generar_mailbox_log(mailbox_log, args.tamano_mb)
+        comparar("mailbox.log (fallos de autenticación)", mailbox_log, mailbox_original, mailbox_bytes)
+
+
+if __name__ == '__main__':
+    main()
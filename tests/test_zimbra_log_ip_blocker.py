@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Pruebas del bloqueador con el backend 'memoria': bloqueo, vencimiento, tiempo de gracia, agrupación
+en subredes, persistencia en SQLite y lectura incremental de los logs con rotación y truncado.
+Se corren con `python -m pytest -q` o `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zimbra_log_ip_blocker as blk
+from Mailbox_zimbra_Logger import actualizar_indice
+
+INICIO = datetime(2026, 3, 2, 12, 0, 0)
+
+
+def epoch(instante):
+    return int(instante.timestamp())
+
+
+def linea_sasl(ip, instante=None):
+    instante = instante or datetime.now()
+    return (f"{instante.strftime('%b %e %H:%M:%S')} mail postfix/smtpd[1234]: warning: unknown[{ip}]: "
+            "SASL LOGIN authentication failed: UGFzc3dvcmQ6\n")
+
+
+def linea_mailbox(ip, cuenta='u@example.com', instante=None):
+    instante = instante or datetime.now()
+    return (f"{instante.strftime('%Y-%m-%d %H:%M:%S')},123 INFO  [qtp1-1] [name={cuenta};oip={ip};ua=zclient;] "
+            f"account - authentication failed for [{cuenta}] (invalid password)\n")
+
+
+class PruebaConDirectorio(unittest.TestCase):
+    """
+    Cada prueba escribe el log de eventos y cualquier archivo en un directorio temporal propio.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+        for nombre, archivo in (('log_debug', 'bloqueo_debug.log'), ('blocked_json', 'ips_bloqueadas.json'),
+                                ('unblocked_json', 'ips_desbloqueadas.json'),
+                                ('checkpoint_json', 'maillog_checkpoint.json')):
+            parche = mock.patch.object(blk, nombre, self.ruta(archivo))
+            parche.start()
+            self.addCleanup(parche.stop)
+
+    def ruta(self, nombre):
+        return os.path.join(self.dir, nombre)
+
+    def crear_bloqueador(self, umbral=2, lista_blanca=()):
+        ventana = blk.VentanaIntentos(umbral, blk.FAILED_ATTEMPTS_WINDOW)
+        buscador = blk.BuscadorPais(mmdb_path=self.ruta('no.mmdb'), csv_path=self.ruta('no.csv'))
+        return blk.Bloqueador(blk.MemoriaBackend(), ventana, blk.ListaBlanca(lista_blanca), buscador)
+
+
+class PruebasBloqueador(PruebaConDirectorio):
+
+    def atacar(self, bloqueador, ip, instante, veces=2):
+        for i in range(veces):
+            bloqueador.registrar_intento(ip, epoch(instante) + i)
+        bloqueador.evaluar(ip, instante + timedelta(seconds=veces))
+
+    def test_bloquea_al_llegar_al_umbral(self):
+        bloqueador = self.crear_bloqueador()
+        bloqueador.registrar_intento('203.0.113.5', epoch(INICIO))
+        bloqueador.evaluar('203.0.113.5', INICIO)
+        self.assertNotIn('203.0.113.5', bloqueador.bloqueadas)
+
+        bloqueador.registrar_intento('203.0.113.5', epoch(INICIO) + 1)
+        bloqueador.evaluar('203.0.113.5', INICIO)
+        self.assertIn('203.0.113.5', bloqueador.bloqueadas)
+
+        bloqueador.aplicar_firewall()
+        self.assertEqual(bloqueador.firewall.bloqueadas, {'203.0.113.5': blk.BLOCK_DURATION.total_seconds()})
+        self.assertEqual(len(bloqueador.firewall.transacciones), 1)
+
+    def test_intentos_fuera_de_la_ventana_no_bloquean(self):
+        bloqueador = self.crear_bloqueador()
+        bloqueador.registrar_intento('203.0.113.5', epoch(INICIO))
+        despues = INICIO + blk.FAILED_ATTEMPTS_WINDOW + timedelta(seconds=1)
+        bloqueador.registrar_intento('203.0.113.5', epoch(despues))
+        bloqueador.evaluar('203.0.113.5', despues)
+        self.assertNotIn('203.0.113.5', bloqueador.bloqueadas)
+
+    def test_lista_blanca_no_cuenta_intentos(self):
+        bloqueador = self.crear_bloqueador(lista_blanca=['10.0.0.0/8'])
+        self.assertFalse(bloqueador.registrar_intento('10.1.2.3', epoch(INICIO)))
+        self.assertFalse(bloqueador.registrar_intento('10.1.2.3', epoch(INICIO) + 1))
+        bloqueador.evaluar('10.1.2.3', INICIO)
+        self.assertEqual(bloqueador.bloqueadas, {})
+
+    def test_vencimiento_y_olvido_tras_la_gracia(self):
+        bloqueador = self.crear_bloqueador()
+        self.atacar(bloqueador, '203.0.113.5', INICIO)
+        bloqueador.aplicar_firewall()
+
+        vence = INICIO + blk.BLOCK_DURATION + timedelta(seconds=5)
+        self.assertLessEqual(bloqueador.proximo_vencimiento(), epoch(vence))
+        bloqueador.procesar_vencimientos(vence)
+        self.assertNotIn('203.0.113.5', bloqueador.bloqueadas)
+        self.assertIn('203.0.113.5', bloqueador.desbloqueadas)
+        bloqueador.aplicar_firewall()
+        self.assertEqual(bloqueador.firewall.bloqueadas, {})
+
+        bloqueador.procesar_vencimientos(vence + blk.REBLOCK_AFTER)
+        self.assertNotIn('203.0.113.5', bloqueador.desbloqueadas)
+
+    def test_ataque_durante_la_gracia_rebloquea_al_terminar(self):
+        bloqueador = self.crear_bloqueador()
+        self.atacar(bloqueador, '203.0.113.5', INICIO)
+        vence = INICIO + blk.BLOCK_DURATION + timedelta(seconds=5)
+        bloqueador.procesar_vencimientos(vence)
+
+        en_gracia = vence + blk.REBLOCK_AFTER / 2
+        self.atacar(bloqueador, '203.0.113.5', en_gracia)
+        self.assertNotIn('203.0.113.5', bloqueador.bloqueadas)
+
+        bloqueador.procesar_vencimientos(vence + blk.REBLOCK_AFTER)
+        self.assertIn('203.0.113.5', bloqueador.bloqueadas)
+        self.assertNotIn('203.0.113.5', bloqueador.desbloqueadas)
+
+    def test_agrupa_la_subred_y_reevalua_sus_ips_al_terminar_la_gracia(self):
+        bloqueador = self.crear_bloqueador()
+        ips = [f'198.51.100.{i}' for i in range(1, blk.AGGREGATE_MIN_IPS + 1)]
+        for ip in ips:
+            self.atacar(bloqueador, ip, INICIO)
+        subred = '198.51.100.0/24'
+        self.assertEqual(list(bloqueador.bloqueadas), [subred])
+        self.assertTrue(bloqueador.bloqueo_vigente('198.51.100.200'))
+        bloqueador.aplicar_firewall()
+        self.assertEqual(list(bloqueador.firewall.bloqueadas), [subred])
+
+        vence = INICIO + blk.BLOCK_DURATION + timedelta(seconds=5)
+        bloqueador.procesar_vencimientos(vence)
+        self.assertIn(subred, bloqueador.desbloqueadas)
+
+        # Un miembro ataca mientras la subred está en gracia: no se bloquea hasta que termine
+        self.atacar(bloqueador, '198.51.100.200', vence + blk.REBLOCK_AFTER / 2)
+        self.assertEqual(bloqueador.bloqueadas, {})
+        bloqueador.procesar_vencimientos(vence + blk.REBLOCK_AFTER)
+        self.assertNotIn(subred, bloqueador.desbloqueadas)
+        self.assertEqual(list(bloqueador.bloqueadas), ['198.51.100.200'])
+
+
+class PruebasEstado(PruebaConDirectorio):
+
+    def test_estado_y_ventana_sobreviven_a_un_reinicio(self):
+        estado = blk.EstadoBloqueos(self.ruta('estado.sqlite3'))
+        checkpoint = estado.cargar_checkpoint()
+        bloqueador = self.crear_bloqueador(umbral=3)
+        for i in range(3):
+            bloqueador.registrar_intento('203.0.113.5', epoch(INICIO) + i)
+        bloqueador.registrar_intento('203.0.113.9', epoch(INICIO))
+        bloqueador.evaluar('203.0.113.5', INICIO)
+        checkpoint['offset'] = 1234
+        bloqueador.guardar(estado, checkpoint)
+
+        estado = blk.EstadoBloqueos(self.ruta('estado.sqlite3'))
+        self.assertEqual(estado.cargar_checkpoint()['offset'], 1234)
+        self.assertEqual([e['ip'] for e in estado.bloqueadas()], ['203.0.113.5'])
+        ventana = estado.cargar_ventana()
+        self.assertEqual(ventana['203.0.113.9'], [epoch(INICIO)])
+
+        # La purga borra de la tabla sólo las IPs que salieron de la ventana
+        bloqueador.ventana.purgar(epoch(INICIO + blk.FAILED_ATTEMPTS_WINDOW) + 10)
+        bloqueador.guardar(estado, checkpoint)
+        self.assertEqual(blk.EstadoBloqueos(self.ruta('estado.sqlite3')).cargar_ventana(), {})
+
+    def test_fusionar_no_cuenta_dos_veces_las_mismas_lineas(self):
+        ventana = blk.VentanaIntentos(3, blk.FAILED_ATTEMPTS_WINDOW)
+        ventana.registrar('203.0.113.5', 100)
+        otra = blk.VentanaIntentos(3, blk.FAILED_ATTEMPTS_WINDOW)
+        otra.registrar('203.0.113.5', 100)
+        otra.registrar('203.0.113.5', 101)
+        ventana.fusionar(otra)
+        self.assertEqual(list(ventana.intentos['203.0.113.5']), [100, 101])
+
+
+class PruebasLectura(PruebaConDirectorio):
+    """
+    Seguimiento de maillog y mailbox.log con el checkpoint, como en cada pasada de cron.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.maillog = self.ruta('maillog')
+        self.mailbox = self.ruta('mailbox.log')
+        for nombre, valor in (('log_path', self.maillog), ('mailbox_log_path', self.mailbox)):
+            parche = mock.patch.object(blk, nombre, valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.checkpoint = blk.checkpoint_desde_dict({})
+        self.vistas = []
+        self.bloqueador = self.crear_bloqueador()
+        self.fuentes = blk.crear_fuentes([blk.consumidor_bloqueo(self.bloqueador, self.vistas.append)])
+
+    def escribir(self, path, texto, modo='a'):
+        with open(path, modo) as f:
+            f.write(texto)
+
+    def leer(self):
+        del self.vistas[:]
+        blk.leer_fuentes(self.fuentes, self.checkpoint)
+        return list(self.vistas)
+
+    def test_lee_solo_lo_nuevo_y_completa_lineas_parciales(self):
+        self.escribir(self.maillog, linea_sasl('203.0.113.1'))
+        self.assertEqual(self.leer(), ['203.0.113.1'])
+        self.assertEqual(self.leer(), [])
+
+        linea = linea_sasl('203.0.113.2')
+        self.escribir(self.maillog, linea[:30])
+        self.assertEqual(self.leer(), [])
+        self.escribir(self.maillog, linea[30:])
+        self.assertEqual(self.leer(), ['203.0.113.2'])
+
+    def test_rotacion_termina_el_archivo_anterior(self):
+        self.escribir(self.maillog, linea_sasl('203.0.113.1'))
+        self.assertEqual(self.leer(), ['203.0.113.1'])
+        # Líneas escritas justo antes de rotar, que la pasada anterior no llegó a ver
+        self.escribir(self.maillog, linea_sasl('203.0.113.2'))
+        os.rename(self.maillog, self.maillog + '.1')
+        self.escribir(self.maillog, linea_sasl('203.0.113.3'), 'w')
+        self.assertEqual(self.leer(), ['203.0.113.2', '203.0.113.3'])
+        self.assertEqual(self.leer(), [])
+
+    def test_truncado_vuelve_a_empezar(self):
+        self.escribir(self.maillog, linea_sasl('203.0.113.1') * 3)
+        self.assertEqual(self.leer(), ['203.0.113.1'] * 3)
+        self.escribir(self.maillog, linea_sasl('203.0.113.4'), 'w')  # copytruncate
+        self.assertEqual(self.leer(), ['203.0.113.4'])
+
+    def test_mailbox_empieza_al_final_y_bloquea_con_oip(self):
+        self.escribir(self.mailbox, linea_mailbox('203.0.113.7'))  # Historia previa: no se lee
+        self.assertEqual(self.leer(), [])
+        self.escribir(self.mailbox, linea_mailbox('203.0.113.8') * 2)
+        self.assertEqual(self.leer(), ['203.0.113.8'] * 2)
+
+        ahora = datetime.now()
+        self.bloqueador.evaluar('203.0.113.8', ahora)
+        self.assertIn('203.0.113.8', self.bloqueador.bloqueadas)
+
+    def test_la_pasada_del_bloqueador_alimenta_el_indice_del_reporte(self):
+        estado = blk.EstadoBloqueos(self.ruta('estado.sqlite3'))
+        rollup = blk.RollupMailbox(self.ruta('rollup.sqlite3'))
+        fuentes = blk.crear_fuentes([blk.consumidor_bloqueo(self.bloqueador, self.vistas.append)], rollup)
+        self.escribir(self.mailbox, '')
+        blk.leer_fuentes(fuentes, self.checkpoint)
+        self.escribir(self.mailbox, linea_mailbox('203.0.113.8') * 3)
+        blk.leer_fuentes(fuentes, self.checkpoint)
+        self.assertTrue(blk.confirmar(self.bloqueador, estado, self.checkpoint, datetime.now(), rollup))
+
+        self.assertIsNone(actualizar_indice(rollup.indice, self.mailbox))  # No relee el log
+        resultado = rollup.indice.resultado()
+        self.assertEqual(resultado.contadores['invalid_password'][('u@example.com', '203.0.113.8')], 3)
+        self.assertEqual(rollup.indice.cargar_checkpoint()['offset'], os.path.getsize(self.mailbox))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Ingesta compartida de los logs de Zimbra (maillog y mailbox.log).
+Cada log se lee una sola vez, en bloques de bytes con líneas completas. Los detectores enchufados
+convierten sus líneas en Eventos, que se reparten a todos los consumidores: contadores del reporte,
+decisión de bloqueo, métricas...
+Lo usan Mailbox_zimbra_Logger.py y zimbra_log_ip_blocker.py.
+"""
+import re
+import os
+import glob
+import time
+from collections import namedtuple
+from datetime import datetime
+from operator import itemgetter
+
+TAMANO_BLOQUE = 1024 * 1024  # Bytes por bloque al escanear o seguir un log (cabe en caché L2)
+
+# Un fallo de autenticación reconocido en un log.
+# origen: 'maillog' o 'mailbox'; categoria: 'sasl' o una de mailbox.log ('invalid_password', ...);
+# cuenta: correo o None; fecha: marca de tiempo tal cual viene en el log; epoch: int o None si no se pudo fechar
+Evento = namedtuple('Evento', 'origen categoria cuenta ip fecha epoch')
+
+
+# --- Detectores ---
+class Detector:
+    """
+    Interfaz de los detectores: MARCADOR es un texto en minúsculas (bytes) que aparece en toda línea
+    relevante, y detectar() recibe la línea cruda buf[inicio:fin] (y el mismo buffer ya pasado a
+    minúsculas, con las mismas posiciones) y devuelve un Evento o None.
+    """
+
+    MARCADOR = b''
+
+    def detectar(self, buf, inicio, fin, minusculas):
+        raise NotImplementedError
+
+
+# --- maillog: fallos SASL de postfix ---
+log_pattern = re.compile(
+    r'^(?P<month>\w{3})\s+(?P<day>\d{1,2})\s+(?P<time>\d{2}:\d{2}:\d{2}) .*?warning: unknown\[(?P<ip>\d{1,3}(?:\.\d{1,3}){3})\]: SASL LOGIN authentication failed'
+)
+# Explicación regex:
+# ^(mes abreviado) (día) (hora:minuto:segundo) ... warning: unknown[ip]: SASL LOGIN authentication failed
+
+month_map = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4,
+    'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8,
+    'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}  # Mapeo de meses abreviados a número para construir datetime
+
+
+class ParserSyslog(Detector):
+    """
+    Extrae (ip, epoch) de los fallos SASL de postfix con el menor trabajo posible por línea:
+    un 'in' de substring descarta casi todo el log antes de cualquier regex, y el prefijo
+    'Mon DD HH:MM:SS' se decodifica a mano con caché por minuto en lugar de strptime.
+    """
+
+    TEXTO = 'SASL LOGIN authentication failed'
+    MARCADOR = TEXTO.lower().encode()
+    patron_ip = re.compile(r'warning: unknown\[(\d{1,3}(?:\.\d{1,3}){3})\]: SASL LOGIN authentication failed')
+    MAX_CACHE = 4096  # Minutos distintos en caché antes de vaciarla
+
+    def __init__(self, referencia=None, metricas=None):
+        # referencia: datetime con el que se infiere el año (el log no lo trae); None = ahora.
+        # Para archivos rotados conviene pasar su fecha de modificación.
+        # metricas: objeto con .segundos (dict fase -> segundos) para cronometrar regex y timestamp
+        self.referencia = referencia
+        self.cache = {}  # 'Mon DD HH:MM' -> epoch del inicio de ese minuto
+        self.metricas = metricas
+
+    def detectar(self, buf, inicio, fin, minusculas):
+        line = buf[inicio:fin].decode('utf-8', 'replace')
+        intento = self.parsear(line)
+        if intento is None:
+            return None
+        return Evento('maillog', 'sasl', None, intento[0], line[:15], intento[1])
+
+    def parsear(self, line):
+        # Devuelve (ip, epoch) si la línea es un fallo SASL, o None
+        if self.TEXTO not in line:
+            return None
+        if self.metricas is not None:
+            return self.parsear_medido(line)
+        match = self.patron_ip.search(line)
+        if not match:
+            return None
+        epoch = self.epoch(line)
+        if epoch is None:
+            return None
+        return match.group(1), epoch
+
+    def parsear_medido(self, line):
+        # Igual que parsear(), cronometrando regex y timestamp por separado
+        t0 = time.perf_counter()
+        match = self.patron_ip.search(line)
+        t1 = time.perf_counter()
+        self.metricas.segundos['regex'] += t1 - t0
+        if not match:
+            return None
+        epoch = self.epoch(line)
+        self.metricas.segundos['timestamp'] += time.perf_counter() - t1
+        if epoch is None:
+            return None
+        return match.group(1), epoch
+
+    def epoch(self, line):
+        # Formato fijo de syslog: 'Oct 17 10:01:02' / 'Oct  7 10:01:02' (día con espacio de relleno)
+        if line[12:13] != ':' or line[15:16] != ' ':
+            return self.epoch_lento(line)
+        clave = line[:12]
+        base = self.cache.get(clave)
+        if base is None:
+            try:
+                base = self.epoch_minuto(month_map[clave[:3]], int(clave[4:6]), int(clave[7:9]), int(clave[10:12]))
+            except (KeyError, ValueError):
+                return None
+            if len(self.cache) >= self.MAX_CACHE:
+                self.cache.clear()
+            self.cache[clave] = base
+        try:
+            return base + int(line[13:15])
+        except ValueError:
+            return None
+
+    def epoch_lento(self, line):
+        # Variantes raras del prefijo (día sin relleno, etc.): se resuelven con la regex completa
+        match = log_pattern.search(line)
+        if not match:
+            return None
+        hora, minuto, segundo = (int(x) for x in match.group('time').split(':'))
+        try:
+            return self.epoch_minuto(month_map[match.group('month')], int(match.group('day')), hora, minuto) + segundo
+        except (KeyError, ValueError):
+            return None
+
+    def epoch_minuto(self, mes, dia, hora, minuto):
+        # Año inferido respecto de la referencia: una línea de diciembre leída en enero es del año
+        # anterior y una de enero leída en diciembre (reloj adelantado) es del siguiente
+        referencia = self.referencia or datetime.now()
+        anio = referencia.year
+        if mes == 12 and referencia.month == 1:
+            anio -= 1
+        elif mes == 1 and referencia.month == 12:
+            anio += 1
+        return int(datetime(anio, mes, dia, hora, minuto).timestamp())
+
+
+# --- mailbox.log: fallos de autenticación ---
+# Sobre bytes: sólo se decodifica lo capturado. Fecha y hora al inicio de línea
+regex_fecha_bytes = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}')
+
+# Los campos se buscan cada uno con su propia regex, acotada al campo: sin '.*?' encadenados, que en
+# líneas con varios '[name=' u 'oip=' (la cuenta y el ua los pone el cliente) retroceden en tiempo cúbico.
+# Tanto el correo como los demás campos del contexto [name=...;oip=...;] terminan en ';', '[' o ']'.
+
+# Regex para invalid password y account lockout (captura name y el oip del mismo contexto)
+regex_general_bytes = re.compile(
+    rb'\[name=([^;\[\]]+)(?:;[^;\[\]]*)*?;oip=(\d+\.\d+\.\d+\.\d+)',
+    re.IGNORECASE
+)
+
+# Regex para account not found: captura correo tras 'authentication failed for [correo]'
+regex_account_not_found_bytes = re.compile(
+    rb'authentication failed for \[([^\[\]]+)\]',
+    re.IGNORECASE
+)
+
+# Regex para capturar cualquier IP (oip o ip) en la línea
+regex_ip_bytes = re.compile(
+    rb'\[(?:oip|ip)=(\d+\.\d+\.\d+\.\d+)',
+    re.IGNORECASE
+)
+
+
+class DetectorMailbox(Detector):
+    """
+    Fallos de autenticación de mailbox.log: 'invalid password' y 'account lockout' con la IP real
+    del cliente (oip=), y 'account not found' con la IP que aparezca (o "IP no encontrada").
+    """
+
+    MARCADOR = b'authentication failed'
+
+    def __init__(self):
+        self.cache = {}  # 'AAAA-MM-DD HH:MM' -> epoch del inicio de ese minuto
+
+    def detectar(self, buf, inicio, fin, minusculas):
+        # La categoría se decide con find() sobre la línea ya en minúsculas y cada campo sale de su
+        # regex acotada, con pos/endpos para no copiar la línea
+        fecha = regex_fecha_bytes.match(buf, inicio, fin)
+        fecha = fecha.group().decode('ascii') if fecha else "Fecha no encontrada"
+        if minusculas.find(b'invalid password', inicio, fin) != -1:
+            categoria = 'invalid_password'
+        elif minusculas.find(b'account lockout', inicio, fin) != -1:
+            categoria = 'account_lockout'
+        elif minusculas.find(b'account not found', inicio, fin) != -1:
+            match_correo = regex_account_not_found_bytes.search(buf, inicio, fin)
+            if match_correo is None:
+                return None
+            match_ip = regex_ip_bytes.search(buf, inicio, fin)
+            ip = match_ip.group(1).decode('ascii') if match_ip else "IP no encontrada"
+            return self.evento('account_not_found', match_correo.group(1).decode('utf-8', 'replace').strip(), ip, fecha)
+        else:
+            return None
+        match = regex_general_bytes.search(buf, inicio, fin)
+        if match is None:
+            return None
+        return self.evento(categoria, match.group(1).decode('utf-8', 'replace').strip(), match.group(2).decode('ascii'), fecha)
+
+    def evento(self, categoria, cuenta, ip, fecha):
+        return Evento('mailbox', categoria, cuenta, ip, fecha, self.epoch(fecha))
+
+    def epoch(self, fecha):
+        # 'AAAA-MM-DD HH:MM:SS,mmm' con caché por minuto; None si la línea no trae fecha
+        base = self.cache.get(fecha[:16])
+        if base is None:
+            try:
+                base = int(datetime.strptime(fecha[:16], '%Y-%m-%d %H:%M').timestamp())
+            except ValueError:
+                return None
+            if len(self.cache) >= ParserSyslog.MAX_CACHE:
+                self.cache.clear()
+            self.cache[fecha[:16]] = base
+        return base + int(fecha[17:19])
+
+
+# --- Motor de ingesta ---
+class Ingesta:
+    """
+    Reparte a todos los consumidores los eventos de todos los detectores en una sola pasada.
+    Cada bloque se pasa a minúsculas una vez (una operación en C) y cada detector busca su MARCADOR
+    con find(); sólo las líneas marcadas llegan a Python. Los consumidores son funciones que
+    reciben un Evento, en el orden en que aparecen en el log.
+    """
+
+    def __init__(self, detectores, consumidores):
+        self.detectores = list(detectores)
+        self.consumidores = list(consumidores)
+
+    def procesar_bloque(self, bloque):
+        # bloque: bytes con líneas completas
+        minusculas = bloque.lower()
+        eventos = []
+        for detector in self.detectores:
+            i = minusculas.find(detector.MARCADOR)
+            while i != -1:
+                inicio_linea = minusculas.rfind(b'\n', 0, i) + 1
+                fin_linea = minusculas.find(b'\n', i)
+                if fin_linea == -1:
+                    fin_linea = len(bloque)
+                evento = detector.detectar(bloque, inicio_linea, fin_linea, minusculas)
+                if evento is not None:
+                    eventos.append((inicio_linea, evento))
+                i = minusculas.find(detector.MARCADOR, fin_linea)
+        if len(self.detectores) > 1:
+            eventos.sort(key=itemgetter(0))
+        for _, evento in eventos:
+            for consumidor in self.consumidores:
+                consumidor(evento)
+
+    def procesar(self, buf, inicio, fin):
+        # Recorre buf[inicio:fin] (bytes o mmap; inicio al comienzo de una línea) en bloques que
+        # terminan en salto de línea
+        pos = inicio
+        while pos < fin:
+            corte = min(pos + TAMANO_BLOQUE, fin)
+            if corte < fin:
+                salto = buf.rfind(b'\n', pos, corte)
+                if salto == -1:
+                    salto = buf.find(b'\n', corte, fin)  # Línea más larga que un bloque
+                corte = fin if salto == -1 else salto + 1
+            self.procesar_bloque(buf[pos:corte])
+            pos = corte
+
+    def seguir(self, path, posicion):
+        # Procesa lo añadido al log desde 'posicion' (ver leer_nuevo) y devuelve (bytes, líneas) leídos
+        leidos = lineas = 0
+        for bloque in leer_nuevo(path, posicion):
+            leidos += len(bloque)
+            lineas += bloque.count(b'\n')
+            self.procesar_bloque(bloque)
+        return leidos, lineas
+
+    def procesar_archivo(self, f):
+        # Archivo completo que ya no crece (rotado, plano o gzip)
+        for bloque in leer_bloques(f, 0, b'', posicion_desde_dict({}), fin_de_archivo=True):
+            self.procesar_bloque(bloque)
+
+
+# --- Lectura incremental con checkpoint ---
+def posicion_desde_dict(data):
+    # Posición guardada de un log o una vacía (leer desde el byte 0)
+    if not isinstance(data, dict):
+        data = {}
+    return {
+        'inode': data.get('inode'),
+        'offset': int(data.get('offset', 0)),
+        # La línea parcial se guarda como latin-1 para conservar los bytes tal cual
+        'parcial': data.get('parcial', '').encode('latin-1'),
+    }
+
+
+def posicion_a_dict(posicion):
+    return {
+        'inode': posicion['inode'],
+        'offset': posicion['offset'],
+        'parcial': posicion['parcial'].decode('latin-1'),
+    }
+
+
+def buscar_rotado(path, inode):
+    # Busca el archivo rotado que conserva el inodo leído la última vez: maillog.1, maillog-AAAAMMDD
+    # o mailbox.log.AAAA-MM-DD (los .gz ya son otro archivo)
+    candidatos = [path + '.1'] + sorted(set(glob.glob(path + '-*')) | set(glob.glob(path + '.*')), reverse=True)
+    for candidato in candidatos:
+        if candidato.endswith('.gz'):
+            continue
+        try:
+            if os.stat(candidato).st_ino == inode:
+                return candidato
+        except OSError:
+            continue
+    return None
+
+
+def leer_bloques(f, offset, parcial, posicion, fin_de_archivo=False):
+    # Lee desde offset hasta el final y devuelve bloques de líneas completas; el resto queda como parcial.
+    # La posición avanza cuando se pide el bloque siguiente, es decir, con el anterior ya procesado:
+    # si algo falla a mitad de la lectura sólo se repite el bloque en curso.
+    f.seek(offset)
+    while True:
+        bloque = f.read(TAMANO_BLOQUE)
+        if not bloque:
+            break
+        offset += len(bloque)
+        datos = parcial + bloque
+        corte = datos.rfind(b'\n') + 1
+        parcial = datos[corte:]
+        if corte:
+            yield datos[:corte]
+        posicion['offset'] = offset
+        posicion['parcial'] = parcial
+    if fin_de_archivo and parcial:
+        # Un archivo rotado ya no crece: su última línea sin salto también es completa
+        yield parcial
+        posicion['parcial'] = b''
+
+
+def leer_nuevo(path, posicion):
+    # Generador de los bloques añadidos desde la última posición, detectando rotación y truncado.
+    # Actualiza la posición en sitio a medida que se consumen los bloques (ver leer_bloques).
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return  # En plena rotación el log nuevo puede no existir aún
+    with f:
+        inode = os.fstat(f.fileno()).st_ino
+        offset = posicion['offset']
+        parcial = posicion['parcial']
+
+        if posicion['inode'] is not None and posicion['inode'] != inode:
+            # El log fue rotado: terminar primero lo que quedó sin leer del archivo anterior
+            rotado = buscar_rotado(path, posicion['inode'])
+            if rotado:
+                with open(rotado, 'rb') as fr:
+                    yield from leer_bloques(fr, offset, parcial, posicion, fin_de_archivo=True)
+            offset, parcial = 0, b''
+        elif os.fstat(f.fileno()).st_size < offset:
+            # El log fue truncado (copytruncate): volver a empezar
+            offset, parcial = 0, b''
+
+        # Inodo y offset cambian juntos, para no quedar con el offset del archivo anterior
+        posicion.update(inode=inode, offset=offset, parcial=parcial)
+        yield from leer_bloques(f, offset, parcial, posicion)
@@ -1,51 +1,146 @@
 #!/usr/bin/env python3
-import re
 import json
 import subprocess
-from collections import defaultdict
+import argparse
+import heapq
+import signal
+import sqlite3
+import time
+import sys
+import socket
+import ipaddress
+import fcntl
+from bisect import bisect_right
+from collections import Counter, deque, defaultdict
 from datetime import datetime, timedelta
 import os
-#import geoip2.database
-from dateutil import parser
+import glob
+import gzip
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from functools import lru_cache
+
+from zimbra_log_ingest import DetectorMailbox, Ingesta, ParserSyslog, posicion_a_dict, posicion_desde_dict
+from Mailbox_zimbra_Logger import INDICE_PATH, AgregadoHorario, IndiceHorario
+try:
+    from inotify_simple import INotify, flags as inotify_flags  # Opcional: sin él el daemon hace polling
+except ImportError:
+    INotify = None
+try:
+    import geoip2.database  # Opcional: sin él se usa la tabla CSV de respaldo (GEOIP_CSV_PATH)
+except ImportError:
+    geoip2 = None
 
 # --- Configuración ---
 BASE_DIR = '/'   # Directorio base donde están el script y los archivos JSON
 log_path = '/var/log/maillog'  # Ruta al archivo de log del mail (donde buscar intentos fallidos)
-blocked_json = os.path.join(BASE_DIR, 'ips_bloqueadas.json')  # Archivo JSON para IPs bloqueadas
-unblocked_json = os.path.join(BASE_DIR, 'ips_desbloqueadas.json')  # Archivo JSON para IPs desbloqueadas
+mailbox_log_path = '/opt/zimbra/log/mailbox.log'  # Log de mailbox de Zimbra que también se sigue (None = sólo maillog)
+state_db = os.path.join(BASE_DIR, 'ips_bloqueos.sqlite3')  # Estado de bloqueos y checkpoint del log (SQLite)
+blocked_json = os.path.join(BASE_DIR, 'ips_bloqueadas.json')  # JSON de IPs bloqueadas (se importa la primera vez; --exportar-json)
+unblocked_json = os.path.join(BASE_DIR, 'ips_desbloqueadas.json')  # JSON de IPs desbloqueadas (ídem)
 log_debug = os.path.join(BASE_DIR, 'bloqueo_debug.log')  # Archivo para registrar eventos/debug
+checkpoint_json = os.path.join(BASE_DIR, 'maillog_checkpoint.json')  # Checkpoint de versiones anteriores (se importa la primera vez)
 
-#GEOIP_DB_PATH = '/usr/share/GeoIP/GeoLite2-Country.mmdb'  # Ruta base para GeoIP (comentada porque no se usa)
+GEOIP_DB_PATH = '/usr/share/GeoIP/GeoLite2-Country.mmdb'  # Base GeoIP de países (se abre una vez, con mmap)
+GEOIP_CSV_PATH = '/usr/share/GeoIP/ip_paises.csv'  # Respaldo sin mmdb: líneas "ip_inicio,ip_fin,pais" (IPv4)
+GEOIP_CACHE_SIZE = 65536  # IPs recientes cuyo país se recuerda (LRU)
 
-FAILED_ATTEMPTS_THRESHOLD = 2  # Número mínimo de intentos fallidos para bloquear una IP
+MAILBOX_ROLLUP_PATH = INDICE_PATH  # Rollup horario de Mailbox_zimbra_Logger (--indice) que se alimenta con esta misma lectura de mailbox.log (None = no)
+MAILBOX_BLOCK_CATEGORIES = ('invalid_password', 'account_lockout')  # Fallos de mailbox.log que cuentan (traen oip=, la IP real del cliente)
+FAILED_ATTEMPTS_THRESHOLD = 2  # Número mínimo de intentos fallidos para bloquear una IP...
+FAILED_ATTEMPTS_WINDOW = timedelta(minutes=10)  # ...dentro de esta ventana deslizante
 BLOCK_DURATION = timedelta(hours=1)  # Tiempo que dura bloqueada una IP
 REBLOCK_AFTER = timedelta(minutes=10)  # Tiempo de gracia tras desbloqueo antes de poder re-bloquear
-whitelist_ips = {'127.0.0.1', '172.16.30.2'}  # IPs que nunca se bloquean (lista blanca)
+COUNTRY_BLOCK_DURATION = {}  # País ISO -> duración de bloqueo propia, p.ej. {'CN': timedelta(hours=24)}
+whitelist_ips = {'127.0.0.1', '172.16.30.2'}  # IPs o redes CIDR IPv4 que nunca se bloquean (lista blanca)
+AGGREGATE_PREFIX = 24  # Largo de prefijo de las subredes en que se agrupan las IPs bloqueadas
+AGGREGATE_MIN_IPS = 8  # IPs bloqueadas de una misma subred a partir de las cuales se bloquea la subred (0 = nunca)
+
+# --- Modo daemon ---
+DAEMON_POLL_INTERVAL = 0.5  # Segundos máximos de espera entre lecturas del log (sin inotify es polling puro)
+DAEMON_CHECKPOINT_INTERVAL = 30  # Segundos máximos entre guardados del checkpoint aunque no haya bloqueos
+BACKFILL_WORKERS = None  # Procesos para --modo backfill (None = uno por núcleo)
+
+# --- Métricas ---
+METRICS_TEXTFILE = None  # p.ej. '/var/lib/node_exporter/textfile_collector/zimbra_log_ip_blocker.prom'; None = sin métricas
+
+# --- Firewall ---
+FIREWALL_BACKEND = 'iptables-restore'  # 'ipset' (expiración en el kernel), 'iptables-restore' o 'memoria' (pruebas)
+FIREWALL_CHAIN = 'INPUT'  # Cadena donde se insertan las reglas DROP / la regla del set
+IPSET_NAME = 'zimbra_bloqueadas'  # Nombre del set hash:net (IPs sueltas y subredes) del backend ipset
+IPTABLES_BIN = '/usr/sbin/iptables'
+IPTABLES_RESTORE_BIN = '/usr/sbin/iptables-restore'
+IPSET_BIN = '/usr/sbin/ipset'
 
 # --- GeoIP ---
-"""
-Función comentada para obtener país a partir de IP usando GeoIP, no se usa actualmente.
-def get_country(ip):
-    try:
-        with geoip2.database.Reader(GEOIP_DB_PATH) as reader:
-            response = reader.country(ip)
-            return response.country.iso_code or "Unknown"
-    except Exception:
-        return "Unknown"
-"""
+class BuscadorPais:
+    """
+    País de origen de una IP. La base mmdb se abre una sola vez en modo mmap y las consultas
+    recientes quedan en un LRU. Sin geoip2 o sin la base, se usa una tabla de rangos ordenada
+    cargada desde un CSV local y consultada con bisect. La carga se hace en la primera consulta:
+    una corrida de cron sin bloqueos nuevos no abre la base ni lee el CSV.
+    """
+
+    def __init__(self, mmdb_path=GEOIP_DB_PATH, csv_path=GEOIP_CSV_PATH, cache=GEOIP_CACHE_SIZE):
+        self.mmdb_path = mmdb_path
+        self.csv_path = csv_path
+        self.cargado = False
+        self.reader = None
+        self.inicios = array('I')
+        self.fines = array('I')
+        self.codigos = []
+        self.pais = lru_cache(maxsize=cache)(self.buscar)
 
-# --- Regex para capturar IP y timestamp de línea de log ---
-log_pattern = re.compile(
-    r'^(?P<month>\w{3})\s+(?P<day>\d{1,2})\s+(?P<time>\d{2}:\d{2}:\d{2}) .*?warning: unknown\[(?P<ip>\d{1,3}(?:\.\d{1,3}){3})\]: SASL LOGIN authentication failed'
-)
-# Explicación regex:
-# ^(mes abreviado) (día) (hora:minuto:segundo) ... warning: unknown[ip]: SASL LOGIN authentication failed
+    def cargar(self):
+        self.cargado = True
+        if geoip2 is not None and os.path.exists(self.mmdb_path):
+            self.reader = geoip2.database.Reader(self.mmdb_path, mode=geoip2.database.MODE_MMAP)
+        elif os.path.exists(self.csv_path):
+            self.cargar_csv(self.csv_path)
 
-month_map = {
-    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4,
-    'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8,
-    'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
-}  # Mapeo de meses abreviados a número para construir datetime
+    def cargar_csv(self, path):
+        # Rangos "inicio,fin,pais" con IPs en notación decimal con puntos o como enteros
+        rangos = []
+        with open(path, 'r') as f:
+            for linea in f:
+                partes = linea.strip().split(',')
+                if len(partes) < 3 or ':' in partes[0]:
+                    continue  # Cabecera, líneas vacías o rangos IPv6
+                try:
+                    inicio = int(partes[0]) if partes[0].isdigit() else ip_a_int(partes[0])
+                    fin = int(partes[1]) if partes[1].isdigit() else ip_a_int(partes[1])
+                except (OSError, ValueError):
+                    continue
+                if fin > 0xFFFFFFFF or inicio > fin:
+                    continue  # Rangos IPv6 en forma entera o filas inválidas: no caben en array('I')
+                rangos.append((inicio, fin, sys.intern(partes[2].strip('"'))))
+        rangos.sort()
+        for inicio, fin, codigo in rangos:
+            self.inicios.append(inicio)
+            self.fines.append(fin)
+            self.codigos.append(codigo)
+
+    def buscar(self, ip):
+        if not self.cargado:
+            self.cargar()
+        # Las subredes agrupadas se resuelven por su dirección de red
+        ip = ip.split('/')[0]
+        if self.reader is not None:
+            try:
+                return self.reader.country(ip).country.iso_code or "Unknown"
+            except Exception:
+                return "Unknown"
+        if not self.inicios:
+            return "Unknown"
+        n = ip_a_int(ip)
+        i = bisect_right(self.inicios, n) - 1
+        if i >= 0 and self.fines[i] >= n:
+            return self.codigos[i]
+        return "Unknown"
 
 # --- Funciones para leer y guardar archivos JSON ---
 def load_json(path):
@@ -59,141 +154,1009 @@ def load_json(path):
     return []  # Si no existe archivo devuelve lista vacía
 
 def save_json(path, data):
-    # Guarda la data en JSON con formato legible (indentado)
-    with open(path, 'w') as f:
+    # Guarda la data en JSON con formato legible (indentado), vía archivo temporal + os.replace
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp, path)
+
+# --- Métricas (textfile de node_exporter) ---
+class Metricas:
+    """
+    Contadores y tiempos por fase de la ejecución (cron) o desde el arranque (daemon).
+    Las fases finas (regex, timestamp) sólo se cronometran si las métricas están activas.
+    """
+
+    def __init__(self):
+        self.destino = METRICS_TEXTFILE
+        self.aviso = None  # Motivo por el que se desactivaron, para registrarlo una sola vez
+        if self.destino and not os.path.isdir(os.path.dirname(self.destino) or '.'):
+            self.aviso = f"Métricas desactivadas: no existe el directorio de {self.destino}"
+            self.destino = None
+        self.ultimo_error = None
+        self.activo = bool(self.destino)
+        self.contadores = defaultdict(int)
+        self.segundos = defaultdict(float)  # Fase -> segundos acumulados
+        self.eventos = defaultdict(int)  # (origen, categoría) -> fallos reconocidos en los logs
+
+    def contar(self, nombre, cantidad=1):
+        self.contadores[nombre] += cantidad
+
+    @contextmanager
+    def medir(self, fase):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.segundos[fase] += time.perf_counter() - inicio
+
+    def texto(self, bloqueadas_actuales):
+        c = self.contadores
+        lectura = self.segundos.get('lectura', 0.0)
+        metricas = [
+            ('lines_read', 'Líneas leídas del log', c['lineas']),
+            ('bytes_read', 'Bytes leídos del log', c['bytes']),
+            ('lines_per_second', 'Líneas leídas por segundo de lectura', c['lineas'] / lectura if lectura else 0),
+            ('sasl_failures', 'Intentos fallidos reconocidos', c['intentos']),
+            ('firewall_forks', 'Procesos lanzados para aplicar el firewall', c['forks']),
+            ('firewall_errors', 'Transacciones de firewall fallidas', c['errores_firewall']),
+            ('blocked', 'IPs o subredes bloqueadas', c['bloqueos']),
+            ('unblocked', 'IPs o subredes desbloqueadas', c['desbloqueos']),
+            ('blocked_current', 'Bloqueos vigentes', bloqueadas_actuales),
+            ('last_run_timestamp_seconds', 'Momento de la última escritura de métricas', time.time()),
+        ]
+        lineas = []
+        for nombre, ayuda, valor in metricas:
+            lineas += [f'# HELP zimbra_blocker_{nombre} {ayuda}', f'# TYPE zimbra_blocker_{nombre} gauge',
+                       f'zimbra_blocker_{nombre} {valor}']
+        lineas += ['# HELP zimbra_blocker_phase_seconds Segundos acumulados por fase',
+                   '# TYPE zimbra_blocker_phase_seconds gauge']
+        for fase, segundos in sorted(self.segundos.items()):
+            lineas.append(f'zimbra_blocker_phase_seconds{{fase="{fase}"}} {segundos:.6f}')
+        lineas += ['# HELP zimbra_blocker_events Fallos de autenticación reconocidos por log y categoría',
+                   '# TYPE zimbra_blocker_events gauge']
+        for (origen, categoria), cantidad in sorted(self.eventos.items()):
+            lineas.append(f'zimbra_blocker_events{{origen="{origen}",categoria="{categoria}"}} {cantidad}')
+        return '\n'.join(lineas) + '\n'
+
+    def escribir(self, bloqueadas_actuales):
+        # node_exporter puede leer en cualquier momento: escribir aparte y renombrar
+        if self.aviso:
+            registrar_evento(self.aviso)
+            self.aviso = None
+        if not self.destino:
+            return
+        tmp = self.destino + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(self.texto(bloqueadas_actuales))
+            os.replace(tmp, self.destino)
+            self.ultimo_error = None
+        except OSError as e:
+            # El daemon escribe cada pocos segundos: el mismo error se registra una sola vez
+            mensaje = f"Error escribiendo métricas en {self.destino}: {e}"
+            if mensaje != self.ultimo_error:
+                registrar_evento(mensaje)
+                self.ultimo_error = mensaje
+
+METRICAS = Metricas()
+
+def ejecutar_comando(comando, **kwargs):
+    # subprocess.run contando el fork para las métricas
+    METRICAS.contar('forks')
+    return subprocess.run(comando, **kwargs)
+
+# --- Backends de firewall ---
+# Cada ejecución acumula el diff (IPs a bloquear / desbloquear) y lo aplica en una sola transacción,
+# en lugar de lanzar un proceso iptables por IP.
+class FirewallBackend:
+    """
+    Interfaz común de los backends: aplicar() recibe todos los cambios de una ejecución.
+    """
+
+    def aplicar(self, bloquear, desbloquear):
+        # bloquear: dict ip -> segundos de bloqueo; desbloquear: set de IPs
+        raise NotImplementedError
+
+
+class IptablesRestoreBackend(FirewallBackend):
+    """
+    Reglas DROP por IP en la cadena, aplicadas en lote con iptables-restore --noflush.
+    """
+
+    def __init__(self, chain=FIREWALL_CHAIN, iptables=IPTABLES_BIN, restore=IPTABLES_RESTORE_BIN):
+        self.chain = chain
+        self.iptables = iptables
+        self.restore = restore
+
+    def reglas_actuales(self):
+        # IPs que ya tienen regla DROP en la cadena (una sola llamada a iptables -S)
+        salida = ejecutar_comando([self.iptables, '-S', self.chain],
+                                capture_output=True, text=True, check=True).stdout
+        actuales = set()
+        for regla in salida.splitlines():
+            partes = regla.split()
+            if partes[:2] == ['-A', self.chain] and '-s' in partes and partes[-2:] == ['-j', 'DROP']:
+                origen = partes[partes.index('-s') + 1]
+                actuales.add(origen[:-3] if origen.endswith('/32') else origen)
+        return actuales
+
+    def aplicar(self, bloquear, desbloquear):
+        if not bloquear and not desbloquear:
+            return
+        # iptables-restore aborta la transacción entera si se borra una regla inexistente,
+        # por eso se calcula el diff contra las reglas que hay realmente
+        actuales = self.reglas_actuales()
+        lineas = ['*filter']
+        for ip in sorted((desbloquear - bloquear.keys()) & actuales):
+            lineas.append(f'-D {self.chain} -s {ip} -j DROP')
+        for ip in sorted(bloquear.keys() - actuales):
+            lineas.append(f'-I {self.chain} -s {ip} -j DROP')
+        if len(lineas) == 1:
+            return
+        lineas.append('COMMIT')
+        ejecutar_comando([self.restore, '--noflush'], input='\n'.join(lineas) + '\n',
+                       text=True, check=True)
+
+
+class IpsetBackend(FirewallBackend):
+    """
+    Set hash:net con timeout nativo: el kernel expira cada entrada aunque el script no vuelva a correr.
+    Una sola regla de iptables (match-set) sustituye a la lista lineal de reglas DROP.
+    """
+
+    def __init__(self, nombre=IPSET_NAME, chain=FIREWALL_CHAIN, ipset=IPSET_BIN, iptables=IPTABLES_BIN):
+        self.nombre = nombre
+        self.chain = chain
+        self.ipset = ipset
+        self.iptables = iptables
+        self.regla_verificada = False
+
+    def asegurar_regla(self):
+        # Inserta la regla que descarta el tráfico del set, sólo si no existe (una vez por proceso)
+        if self.regla_verificada:
+            return
+        regla = [self.chain, '-m', 'set', '--match-set', self.nombre, 'src', '-j', 'DROP']
+        if ejecutar_comando([self.iptables, '-C'] + regla, capture_output=True).returncode != 0:
+            ejecutar_comando([self.iptables, '-I'] + regla, check=True)
+        self.regla_verificada = True
+
+    def aplicar(self, bloquear, desbloquear):
+        if not bloquear and not desbloquear:
+            return
+        lineas = [f'create {self.nombre} hash:net timeout {int(BLOCK_DURATION.total_seconds())} -exist']
+        for ip in sorted(desbloquear - bloquear.keys()):
+            lineas.append(f'del {self.nombre} {ip} -exist')
+        for ip, segundos in sorted(bloquear.items()):
+            lineas.append(f'add {self.nombre} {ip} timeout {int(segundos)} -exist')
+        ejecutar_comando([self.ipset, 'restore'], input='\n'.join(lineas) + '\n', text=True, check=True)
+        self.asegurar_regla()
+
+
+class MemoriaBackend(FirewallBackend):
+    """
+    Backend en memoria para pruebas: no toca el firewall, sólo registra las transacciones.
+    """
 
-# --- Leer estados previos desde JSON ---
-blocked_data = load_json(blocked_json)  # Lista de IPs bloqueadas con fechas
-unblocked_data = load_json(unblocked_json)  # Lista de IPs desbloqueadas con fechas
+    def __init__(self):
+        self.bloqueadas = {}
+        self.transacciones = []
 
-# Diccionarios para manejar IPs y sus fechas como datetime
-blocked_ips = {}
-for entry in blocked_data:
+    def aplicar(self, bloquear, desbloquear):
+        if not bloquear and not desbloquear:
+            return
+        self.transacciones.append((dict(bloquear), set(desbloquear)))
+        for ip in desbloquear - bloquear.keys():
+            self.bloqueadas.pop(ip, None)
+        self.bloqueadas.update(bloquear)
+
+
+FIREWALL_BACKENDS = {
+    'iptables-restore': IptablesRestoreBackend,
+    'ipset': IpsetBackend,
+    'memoria': MemoriaBackend,
+}
+
+def crear_backend(nombre):
+    # Instancia el backend configurado en FIREWALL_BACKEND
     try:
-        bloqueado_hasta = parser.parse(entry['bloqueado_hasta'])  # Convierte string ISO a datetime
-        blocked_ips[entry['ip']] = bloqueado_hasta
-    except Exception as e:
-        print(f"Error procesando entrada bloqueada: {entry} -> {e}")
+        return FIREWALL_BACKENDS[nombre]()
+    except KeyError:
+        raise ValueError(f"Backend de firewall desconocido: {nombre}") from None
+
+# --- Conteo de intentos en ventana deslizante ---
+class VentanaIntentos:
+    """
+    Intentos fallidos recientes por IP, como epochs enteros en un ring buffer acotado.
+    Para saber si hubo N intentos en la ventana bastan los N últimos, así que cada IP ocupa
+    como mucho FAILED_ATTEMPTS_THRESHOLD enteros sin importar cuánto historial se lea.
+    """
+
+    PURGAR_CADA = 10000  # Registros entre purgas de IPs sin actividad dentro de la ventana
+
+    def __init__(self, umbral, ventana):
+        self.umbral = umbral
+        self.ventana = int(ventana.total_seconds())
+        self.intentos = {}  # IP -> deque(maxlen=umbral) de epochs
+        self.registros = 0
+        self.cambiadas = set()  # IPs con intentos nuevos u olvidadas desde el último guardado
+        self.ultima_purga = 0
+
+    def registrar(self, ip, epoch):
+        buffer = self.intentos.get(ip)
+        if buffer is None:
+            buffer = self.intentos[ip] = deque(maxlen=self.umbral)
+        buffer.append(epoch)
+        self.cambiadas.add(ip)
+        self.registros += 1
+        if self.registros % self.PURGAR_CADA == 0:
+            # El log es cronológico: lo anterior a esta línea menos la ventana ya no cuenta
+            self.purgar(epoch)
+
+    def recientes(self, ip, ahora):
+        # Intentos de la IP dentro de la ventana que termina en 'ahora'
+        desde = ahora - self.ventana
+        return sum(1 for epoch in self.intentos.get(ip, ()) if epoch > desde)
+
+    def supera_umbral(self, ip, ahora):
+        return self.recientes(ip, ahora) >= self.umbral
+
+    def purgar(self, ahora):
+        # Olvidar IPs cuyo último intento quedó fuera de la ventana
+        desde = ahora - self.ventana
+        for ip in [ip for ip, buffer in self.intentos.items() if buffer[-1] <= desde]:
+            del self.intentos[ip]
+            self.cambiadas.add(ip)
+        self.ultima_purga = ahora
+
+    def purgar_vencidas(self, ahora):
+        # Recorrer todas las IPs cuesta O(n): al guardar alcanza con hacerlo una vez por ventana
+        if ahora - self.ultima_purga >= self.ventana:
+            self.purgar(ahora)
+
+    def fusionar(self, otra):
+        # Une los intentos de otra ventana sin contar dos veces los mismos: las dos pueden venir de
+        # las mismas líneas (backfill sobre lo que el cron ya leyó), así que cada epoch cuenta las
+        # veces que aparece en la que más lo tiene
+        for ip, buffer in otra.intentos.items():
+            epochs = Counter(self.intentos.get(ip, ())) | Counter(buffer)
+            self.intentos[ip] = deque(sorted(epochs.elements()), maxlen=self.umbral)
+            self.cambiadas.add(ip)
+
+    def cambios(self):
+        # IP -> epochs actuales, o None si se olvidó; sólo las que cambiaron desde la última llamada
+        cambios = {ip: list(self.intentos[ip]) if ip in self.intentos else None for ip in self.cambiadas}
+        self.cambiadas = set()
+        return cambios
+
+    @classmethod
+    def desde_dict(cls, data, umbral, ventana):
+        instancia = cls(umbral, ventana)
+        for ip, epochs in data.items():
+            instancia.intentos[ip] = deque(epochs, maxlen=umbral)
+        return instancia
+
+# --- Lista blanca CIDR y subredes ---
+MASCARA_AGREGADO = (0xFFFFFFFF << (32 - AGGREGATE_PREFIX)) & 0xFFFFFFFF
+
+def ip_a_int(ip):
+    return int.from_bytes(socket.inet_aton(ip), 'big')
 
-unblocked_ips = {}
-for entry in unblocked_data:
+def ip_valida(ip):
+    # Las regex de los logs aceptan cualquier d.d.d.d (p.ej. oip=300.1.1.1 en una línea armada)
     try:
-        desbloqueada = parser.parse(entry['desbloqueada'])  # Convierte string ISO a datetime
-        unblocked_ips[entry['ip']] = desbloqueada
-    except Exception as e:
-        print(f"Error procesando entrada desbloqueada: {entry} -> {e}")
+        ipaddress.IPv4Address(ip)
+    except ValueError:
+        return False
+    return True
 
-# --- Leer log para detectar intentos fallidos ---
-current_year = datetime.now().year  # Año actual para completar timestamp (el log no tiene año)
-ip_attempts = defaultdict(list)  # Diccionario donde clave=IP, valor=lista de timestamps de intentos fallidos
+def subred_de(ip):
+    # Subred de agregación (AGGREGATE_PREFIX) que contiene a la IP, como 'a.b.c.0/24'
+    return f"{socket.inet_ntoa((ip_a_int(ip) & MASCARA_AGREGADO).to_bytes(4, 'big'))}/{AGGREGATE_PREFIX}"
 
-try:
-    with open(log_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            match = log_pattern.search(line)  # Busca patrón en la línea
-            if match:
-                ip = match.group('ip')
-                if ip in whitelist_ips:
-                    continue  # Ignorar IPs en whitelist
-                month = month_map[match.group('month')]
-                day = int(match.group('day'))
-                time_str = match.group('time')
-                # Construir datetime completo con año actual
-                timestamp = datetime.strptime(f"{current_year}-{month}-{day} {time_str}", "%Y-%m-%d %H:%M:%S")
-                ip_attempts[ip].append(timestamp)  # Guardar intento fallido
-except Exception as e:
-    # Registrar errores al leer log
+class ListaBlanca:
+    """
+    Lista blanca de IPs y redes CIDR IPv4 como intervalos [inicio, fin] ordenados y sin solapes:
+    cada consulta es un bisect, O(log n) aunque haya miles de redes.
+    """
+
+    def __init__(self, entradas):
+        intervalos = []
+        for entrada in entradas:
+            try:
+                red = ipaddress.ip_network(entrada, strict=False)
+            except ValueError as e:
+                print(f"Entrada de lista blanca inválida: {entrada} -> {e}")
+                continue
+            if red.version == 4:
+                intervalos.append((int(red.network_address), int(red.broadcast_address)))
+        # Fusionar redes contiguas o solapadas
+        self.inicios, self.fines = [], []
+        for inicio, fin in sorted(intervalos):
+            if self.fines and inicio <= self.fines[-1] + 1:
+                self.fines[-1] = max(self.fines[-1], fin)
+            else:
+                self.inicios.append(inicio)
+                self.fines.append(fin)
+
+    def solapa(self, inicio, fin):
+        # ¿Algún intervalo de la lista corta el rango [inicio, fin]?
+        i = bisect_right(self.inicios, fin) - 1
+        return i >= 0 and self.fines[i] >= inicio
+
+    def contiene(self, ip):
+        n = ip_a_int(ip)
+        return self.solapa(n, n)
+
+    def solapa_red(self, cidr):
+        red = ipaddress.ip_network(cidr)
+        return self.solapa(int(red.network_address), int(red.broadcast_address))
+
+# --- Checkpoint de lectura de los logs ---
+def checkpoint_desde_dict(data):
+    # Devuelve el checkpoint guardado o uno vacío (leer desde el byte 0). La posición de maillog va
+    # en el primer nivel, como en versiones anteriores; la de mailbox.log, bajo 'mailbox', o None si
+    # todavía no se siguió nunca (ver leer_fuentes).
+    if not isinstance(data, dict):
+        data = {}
+    checkpoint = posicion_desde_dict(data)
+    checkpoint['mailbox'] = posicion_desde_dict(data['mailbox']) if isinstance(data.get('mailbox'), dict) else None
+    return checkpoint
+
+def checkpoint_a_dict(checkpoint):
+    data = posicion_a_dict(checkpoint)
+    if checkpoint['mailbox'] is not None:
+        data['mailbox'] = posicion_a_dict(checkpoint['mailbox'])
+    return data
+
+# --- Estado persistente indexado por IP ---
+class EstadoBloqueos:
+    """
+    Estado en SQLite con la IP como clave primaria. Cada confirmación escribe sólo las IPs que
+    cambiaron (bloqueos, desbloqueos e intentos en la ventana), junto con el checkpoint del log, en
+    una única transacción: un corte a mitad de escritura deja el estado anterior intacto.
+    La primera vez importa los JSON existentes.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS bloqueadas ('
+                              'ip TEXT PRIMARY KEY, bloqueado_desde TEXT NOT NULL, bloqueado_hasta TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS desbloqueadas ('
+                              'ip TEXT PRIMARY KEY, desbloqueada TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)')
+            # Intentos recientes por IP (ver VentanaIntentos), como epochs separados por comas
+            self.conn.execute('CREATE TABLE IF NOT EXISTS ventana (ip TEXT PRIMARY KEY, epochs TEXT NOT NULL) WITHOUT ROWID')
+            for tabla in ('bloqueadas', 'desbloqueadas'):
+                columnas = [fila[1] for fila in self.conn.execute(f'PRAGMA table_info({tabla})')]
+                if 'pais_origen' not in columnas:
+                    self.conn.execute(f"ALTER TABLE {tabla} ADD COLUMN pais_origen TEXT NOT NULL DEFAULT 'Unknown'")
+        if self.leer_meta('importado') is None:
+            self.importar_json()
+        self.migrar_ventana()
+
+    def migrar_ventana(self):
+        # Versiones anteriores guardaban la ventana dentro del checkpoint, reescrita entera en cada
+        # confirmación: se pasa a su tabla una sola vez
+        valor = self.leer_meta('checkpoint')
+        data = json.loads(valor) if valor else None
+        if not isinstance(data, dict) or 'ventana' not in data:
+            return
+        ventana = data.pop('ventana') or {}
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO ventana VALUES (?, ?)',
+                                  [(ip, ','.join(map(str, epochs))) for ip, epochs in ventana.items() if epochs])
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('checkpoint', ?)", (json.dumps(data),))
+
+    def leer_meta(self, clave):
+        fila = self.conn.execute('SELECT valor FROM meta WHERE clave = ?', (clave,)).fetchone()
+        return fila[0] if fila else None
+
+    def importar_json(self):
+        # Migración desde ips_bloqueadas.json / ips_desbloqueadas.json / maillog_checkpoint.json
+        bloqueadas, desbloqueadas = [], []
+        for entry in load_json(blocked_json):
+            try:
+                bloqueadas.append((entry['ip'], datetime.fromisoformat(entry['bloqueado_desde']).isoformat(),
+                                   datetime.fromisoformat(entry['bloqueado_hasta']).isoformat(),
+                                   entry.get('pais_origen', 'Unknown')))
+            except Exception as e:
+                print(f"Error procesando entrada bloqueada: {entry} -> {e}")
+        for entry in load_json(unblocked_json):
+            try:
+                desbloqueadas.append((entry['ip'], datetime.fromisoformat(entry['desbloqueada']).isoformat(),
+                                      entry.get('pais_origen', 'Unknown')))
+            except Exception as e:
+                print(f"Error procesando entrada desbloqueada: {entry} -> {e}")
+        data = load_json(checkpoint_json)
+        checkpoint = checkpoint_a_dict(checkpoint_desde_dict(data))
+        if isinstance(data, dict) and 'ventana' in data:
+            checkpoint['ventana'] = data['ventana']  # Lo pasa a su tabla migrar_ventana()
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO bloqueadas (ip, bloqueado_desde, bloqueado_hasta, pais_origen) '
+                                  'VALUES (?, ?, ?, ?)', bloqueadas)
+            self.conn.executemany('INSERT OR REPLACE INTO desbloqueadas (ip, desbloqueada, pais_origen) '
+                                  'VALUES (?, ?, ?)', desbloqueadas)
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('checkpoint', json.dumps(checkpoint)))
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('importado', datetime.now().isoformat()))
+        registrar_evento(f"Estado importado desde JSON: {len(bloqueadas)} bloqueadas, {len(desbloqueadas)} desbloqueadas")
+
+    def bloqueadas(self):
+        # Registros {"ip", "bloqueado_desde", "bloqueado_hasta", "pais_origen"}
+        filas = self.conn.execute('SELECT ip, bloqueado_desde, bloqueado_hasta, pais_origen FROM bloqueadas')
+        return [{"ip": ip, "bloqueado_desde": desde, "bloqueado_hasta": hasta, "pais_origen": pais}
+                for ip, desde, hasta, pais in filas]
+
+    def desbloqueadas(self):
+        # Registros {"ip", "desbloqueada", "pais_origen"}
+        filas = self.conn.execute('SELECT ip, desbloqueada, pais_origen FROM desbloqueadas')
+        return [{"ip": ip, "desbloqueada": desbloqueada, "pais_origen": pais} for ip, desbloqueada, pais in filas]
+
+    def cargar_checkpoint(self):
+        valor = self.leer_meta('checkpoint')
+        return checkpoint_desde_dict(json.loads(valor) if valor else {})
+
+    def cargar_ventana(self):
+        # IP -> lista de epochs, para VentanaIntentos.desde_dict
+        return {ip: [int(epoch) for epoch in epochs.split(',')]
+                for ip, epochs in self.conn.execute('SELECT ip, epochs FROM ventana')}
+
+    def confirmar(self, bloqueadas, desbloqueadas, checkpoint, ventana=None):
+        # bloqueadas / desbloqueadas: IP -> registro nuevo, o None para borrarla de esa tabla.
+        # ventana: IP -> epochs, o None para olvidarla (VentanaIntentos.cambios)
+        ventana = ventana or {}
+        with self.conn:
+            self.conn.executemany('DELETE FROM ventana WHERE ip = ?',
+                                  [(ip,) for ip, epochs in ventana.items() if not epochs])
+            self.conn.executemany('INSERT OR REPLACE INTO ventana VALUES (?, ?)',
+                                  [(ip, ','.join(map(str, epochs))) for ip, epochs in ventana.items() if epochs])
+            self.conn.executemany('DELETE FROM bloqueadas WHERE ip = ?',
+                                  [(ip,) for ip, entry in bloqueadas.items() if entry is None])
+            self.conn.executemany('INSERT OR REPLACE INTO bloqueadas (ip, bloqueado_desde, bloqueado_hasta, pais_origen) '
+                                  'VALUES (?, ?, ?, ?)',
+                                  [(ip, e['bloqueado_desde'], e['bloqueado_hasta'], e['pais_origen'])
+                                   for ip, e in bloqueadas.items() if e is not None])
+            self.conn.executemany('DELETE FROM desbloqueadas WHERE ip = ?',
+                                  [(ip,) for ip, entry in desbloqueadas.items() if entry is None])
+            self.conn.executemany('INSERT OR REPLACE INTO desbloqueadas (ip, desbloqueada, pais_origen) VALUES (?, ?, ?)',
+                                  [(ip, e['desbloqueada'], e['pais_origen'])
+                                   for ip, e in desbloqueadas.items() if e is not None])
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                              ('checkpoint', json.dumps(checkpoint_a_dict(checkpoint))))
+
+    def exportar_json(self):
+        # Vuelca el estado a los JSON de siempre, para consultas o herramientas externas
+        save_json(blocked_json, self.bloqueadas())
+        save_json(unblocked_json, self.desbloqueadas())
+
+def registrar_evento(mensaje):
+    # Agrega una línea al log de debug (bloqueos, desbloqueos y errores)
     with open(log_debug, 'a') as logf:
-        logf.write(f"{datetime.now()} - Error leyendo log: {e}\n")
-
-# --- Procesar bloqueos y desbloqueos ---
-now = datetime.now()  # Tiempo actual para comparaciones
-updated_blocked = []  # Lista actualizada de IPs bloqueadas para guardar
-updated_unblocked = []  # Lista actualizada de IPs desbloqueadas para guardar
-
-# Abrir archivo de debug para escribir eventos de bloqueo/desbloqueo
-with open(log_debug, 'a') as logf:
-
-    # Primero, desbloquear IPs cuyo tiempo de bloqueo expiró
-    for ip in list(blocked_ips.keys()):
-        if now >= blocked_ips[ip]:
-            # Quitar regla de bloqueo iptables para la IP
-            subprocess.run(['/usr/sbin/iptables', '-D', 'INPUT', '-s', ip, '-j', 'DROP'])
-            logf.write(f"{now} - Desbloqueada IP: {ip}\n")  # Log de desbloqueo
-            # Agregar registro de desbloqueo
-            unblocked_data.append({
-                "ip": ip,
-                "desbloqueada": now.isoformat(),
-#                "pais_origen": get_country(ip)  # Comentado porque la función está deshabilitada
-            })
-            unblocked_ips[ip] = now  # Actualizar diccionario de IPs desbloqueadas
-            blocked_ips.pop(ip)  # Quitar IP de bloqueadas
-            # Actualizar lista bloqueadas para eliminar esta IP
-            blocked_data = [e for e in blocked_data if e['ip'] != ip]
-
-    # Procesar cada IP con intentos registrados
-    for ip, timestamps in ip_attempts.items():
-
-        if ip in blocked_ips:
-            # IP sigue bloqueada, conservar registro en la lista actualizada
-            entry = next((e for e in blocked_data if e['ip'] == ip), None)
-            if entry:
-                updated_blocked.append(entry)
-
-        elif ip in unblocked_ips:
-            # IP está desbloqueada, verificar si se debe re-bloquear
-            tiempo_desbloqueo = unblocked_ips[ip]
-            if now - tiempo_desbloqueo > REBLOCK_AFTER:
-                # Pasó tiempo de gracia, verificar intentos para bloquear
-                if len(timestamps) >= FAILED_ATTEMPTS_THRESHOLD:
-                    # Re-bloquear IP
-                    subprocess.run(['/usr/sbin/iptables', '-I', 'INPUT', '-s', ip, '-j', 'DROP'])
-                    bloqueado_hasta = now + BLOCK_DURATION
-                    logf.write(f"{now} - Rebloqueada IP: {ip} tras seguir atacando\n")
-                    new_entry = {
-                        "ip": ip,
-                        "bloqueado_desde": now.isoformat(),
-                        "bloqueado_hasta": bloqueado_hasta.isoformat()
-#                        "pais_origen": get_country(ip)
-                    }
-                    updated_blocked.append(new_entry)
-                    blocked_ips[ip] = bloqueado_hasta
-                    unblocked_ips.pop(ip)  # Quitar de desbloqueadas
-
-                else:
-                    # Sigue desbloqueada, conservar registro
-                    updated_unblocked.append({
-                        "ip": ip,
-                        "desbloqueada": tiempo_desbloqueo.isoformat()
-#                       "pais_origen": get_country(ip)
-                    })
+        logf.write(f"{datetime.now()} - {mensaje}\n")
+
+# --- Ingesta de los logs (zimbra_log_ingest) ---
+def cuenta_para_bloqueo(evento):
+    # Fallos fechados de maillog y, de mailbox.log, sólo las categorías con la IP real del cliente.
+    # Una IP mal formada se descarta: si llegara a la lista blanca cortaría la lectura en cada pasada.
+    return (evento.epoch is not None
+            and (evento.origen != 'mailbox' or evento.categoria in MAILBOX_BLOCK_CATEGORIES)
+            and ip_valida(evento.ip))
+
+def consumidor_bloqueo(bloqueador, al_intento):
+    # Lleva los fallos a la ventana de intentos; al_intento(ip) recibe cada IP que sumó un intento
+    def consumir(evento):
+        if cuenta_para_bloqueo(evento) and bloqueador.registrar_intento(evento.ip, evento.epoch):
+            al_intento(evento.ip)
+    return consumir
+
+def consumidor_metricas(evento):
+    METRICAS.eventos[(evento.origen, evento.categoria)] += 1
+
+def crear_fuentes(consumidores, rollup=None):
+    # (log, clave de su posición en el checkpoint, ingesta): maillog siempre y mailbox.log si está
+    # configurado. Cada log se lee una vez y sus eventos van a todos los consumidores; los de
+    # mailbox.log también al rollup del reporte, si hay.
+    fuentes = [(log_path, None, Ingesta([ParserSyslog(metricas=METRICAS if METRICAS.activo else None)], consumidores))]
+    if mailbox_log_path:
+        consumidores_mailbox = consumidores + [rollup.consumir] if rollup else consumidores
+        fuentes.append((mailbox_log_path, 'mailbox', Ingesta([DetectorMailbox()], consumidores_mailbox)))
+    return fuentes
+
+class RollupMailbox:
+    """
+    Conteos horarios de mailbox.log para el índice de Mailbox_zimbra_Logger (--indice), sumados
+    con los mismos eventos que lee el bloqueador: el reporte ya no necesita recorrer el log.
+    """
+
+    ALIMENTADOR = 'zimbra_log_ip_blocker'
+
+    def __init__(self, path):
+        self.indice = IndiceHorario(path)
+        self.agregado = AgregadoHorario()
+
+    def consumir(self, evento):
+        self.agregado.registrar(evento.categoria, evento.cuenta, evento.ip, evento.fecha)
+
+    def confirmar(self, posicion):
+        # Conteos y posición de mailbox.log juntos; si falla, el agregado se conserva para reintentar
+        self.indice.confirmar(self.agregado, posicion, self.ALIMENTADOR)
+        self.agregado = AgregadoHorario()
+
+def crear_rollup():
+    if not (MAILBOX_ROLLUP_PATH and mailbox_log_path):
+        return None
+    try:
+        return RollupMailbox(MAILBOX_ROLLUP_PATH)
+    except sqlite3.Error as e:
+        registrar_evento(f"Índice horario {MAILBOX_ROLLUP_PATH} no disponible: {e}")
+        return None
+
+def posicion_al_final(path):
+    # Posición inicial de un log que se empieza a seguir con historia ya escrita (p.ej. mailbox.log al
+    # actualizar desde una versión que sólo leía maillog): se arranca en el final en vez de releer
+    # decenas de GB. Lo ya escrito no se lee nunca; sólo se pierden los intentos de la última ventana
+    posicion = posicion_desde_dict({})
+    try:
+        estado = os.stat(path)
+    except FileNotFoundError:
+        return posicion  # Cuando aparezca se lee desde el principio
+    posicion.update(inode=estado.st_ino, offset=estado.st_size)
+    if estado.st_size:
+        registrar_evento(f"{path}: primera lectura, se empieza en el byte {estado.st_size} (lo anterior no se analiza)")
+    return posicion
+
+def leer_fuentes(fuentes, checkpoint):
+    # Procesa lo nuevo de cada log; las posiciones se actualizan dentro del checkpoint
+    for path, clave, ingesta in fuentes:
+        if clave and checkpoint[clave] is None:
+            checkpoint[clave] = posicion_al_final(path)
+        leidos, lineas = ingesta.seguir(path, checkpoint[clave] if clave else checkpoint)
+        METRICAS.contar('bytes', leidos)
+        METRICAS.contar('lineas', lineas)
+
+# --- Estado y decisiones de bloqueo ---
+class Bloqueador:
+    """
+    Estado de bloqueos y reglas de decisión, compartido por el modo cron y el modo daemon.
+    Los vencimientos (fin de bloqueo y fin del tiempo de gracia) van en un min-heap,
+    así cada expiración cuesta O(log n) en lugar de recorrer todas las IPs bloqueadas.
+    Cuando una subred acumula AGGREGATE_MIN_IPS IPs bloqueadas, se reemplazan por una sola
+    regla para la subred; las claves de estado pueden ser IPs o subredes CIDR.
+    """
+
+    def __init__(self, firewall, ventana, lista_blanca, buscador_pais):
+        self.firewall = firewall
+        self.ventana = ventana
+        self.lista_blanca = lista_blanca
+        self.buscador_pais = buscador_pais
+        self.paises = {}  # IP -> país de origen, para bloqueadas y desbloqueadas
+        self.miembros = defaultdict(set)  # Subred de agregación -> IPs sueltas bloqueadas dentro de ella
+        self.bloqueadas = {}  # IP -> registro {"ip", "bloqueado_desde", "bloqueado_hasta"}
+        self.bloqueadas_hasta = {}  # IP -> datetime en que vence el bloqueo
+        self.desbloqueadas = {}  # IP -> datetime del desbloqueo (mientras dura el tiempo de gracia)
+        self.vencimientos = []  # Min-heap de (epoch, tipo, ip); las entradas obsoletas se descartan al salir
+        self.pendientes_bloqueo = {}  # IP -> segundos de bloqueo a aplicar en el próximo lote
+        self.pendientes_desbloqueo = set()  # IPs cuya regla hay que quitar en el próximo lote
+        self.cambiadas = set()  # IPs con estado nuevo sin guardar
+
+    def cargar(self, blocked_data, unblocked_data):
+        # Reconstruye el estado desde los registros guardados
+        for entry in blocked_data:
+            try:
+                bloqueado_hasta = datetime.fromisoformat(entry['bloqueado_hasta'])
+            except Exception as e:
+                print(f"Error procesando entrada bloqueada: {entry} -> {e}")
+                continue
+            self.bloqueadas[entry['ip']] = entry
+            self.bloqueadas_hasta[entry['ip']] = bloqueado_hasta
+            self.paises[entry['ip']] = entry.get('pais_origen', 'Unknown')
+            self.vencimientos.append((int(bloqueado_hasta.timestamp()), 'bloqueo', entry['ip']))
+            if '/' not in entry['ip']:
+                self.miembros[subred_de(entry['ip'])].add(entry['ip'])
+        for entry in unblocked_data:
+            try:
+                desbloqueada = datetime.fromisoformat(entry['desbloqueada'])
+            except Exception as e:
+                print(f"Error procesando entrada desbloqueada: {entry} -> {e}")
+                continue
+            self.desbloqueadas[entry['ip']] = desbloqueada
+            self.paises[entry['ip']] = entry.get('pais_origen', 'Unknown')
+            self.vencimientos.append((int((desbloqueada + REBLOCK_AFTER).timestamp()), 'gracia', entry['ip']))
+        heapq.heapify(self.vencimientos)
+
+    def registrar_intento(self, ip, epoch):
+        # Suma un intento fallido; devuelve False si la IP está en la lista blanca
+        if self.lista_blanca.contiene(ip):
+            return False
+        METRICAS.contar('intentos')
+        self.ventana.registrar(ip, epoch)
+        return True
+
+    def bloquear(self, ip, now, motivo):
+        pais = self.paises.get(ip) or self.buscador_pais.pais(ip)
+        duracion = COUNTRY_BLOCK_DURATION.get(pais, BLOCK_DURATION)
+        bloqueado_hasta = now + duracion
+        self.bloqueadas[ip] = {
+            "ip": ip,
+            "bloqueado_desde": now.isoformat(),
+            "bloqueado_hasta": bloqueado_hasta.isoformat(),
+            "pais_origen": pais
+        }
+        self.bloqueadas_hasta[ip] = bloqueado_hasta
+        self.paises[ip] = pais
+        self.desbloqueadas.pop(ip, None)
+        self.pendientes_bloqueo[ip] = duracion.total_seconds()
+        self.pendientes_desbloqueo.discard(ip)
+        heapq.heappush(self.vencimientos, (int(bloqueado_hasta.timestamp()), 'bloqueo', ip))
+        self.cambiadas.add(ip)
+        METRICAS.contar('bloqueos')
+        registrar_evento(f"{motivo} ({pais})")
+        if '/' not in ip and AGGREGATE_MIN_IPS:
+            subred = subred_de(ip)
+            self.miembros[subred].add(ip)
+            if len(self.miembros[subred]) >= AGGREGATE_MIN_IPS and not self.lista_blanca.solapa_red(subred):
+                self.agrupar(subred, now)
+
+    def agrupar(self, subred, now):
+        # Reemplaza las reglas de las IPs sueltas por una sola regla para toda la subred
+        miembros = self.miembros.pop(subred)
+        for ip in miembros:
+            self.bloqueadas.pop(ip)
+            self.bloqueadas_hasta.pop(ip)  # Su entrada en el heap queda obsoleta y se descarta al salir
+            self.paises.pop(ip, None)
+            self.pendientes_bloqueo.pop(ip, None)
+            self.pendientes_desbloqueo.add(ip)
+            self.cambiadas.add(ip)
+        self.bloquear(subred, now, f"Bloqueada subred: {subred} agrupando {len(miembros)} IPs bloqueadas")
+
+    def bloqueo_vigente(self, ip):
+        # La IP está bloqueada por sí misma o dentro de una subred agrupada
+        return ip in self.bloqueadas or (AGGREGATE_MIN_IPS and subred_de(ip) in self.bloqueadas)
+
+    def desbloquear(self, ip, now):
+        self.bloqueadas.pop(ip)
+        self.bloqueadas_hasta.pop(ip)
+        if '/' not in ip:
+            subred = subred_de(ip)
+            self.miembros[subred].discard(ip)
+            if not self.miembros[subred]:
+                del self.miembros[subred]
+        self.desbloqueadas[ip] = now
+        self.pendientes_desbloqueo.add(ip)
+        self.pendientes_bloqueo.pop(ip, None)
+        heapq.heappush(self.vencimientos, (int((now + REBLOCK_AFTER).timestamp()), 'gracia', ip))
+        self.cambiadas.add(ip)
+        METRICAS.contar('desbloqueos')
+        registrar_evento(f"Desbloqueada IP: {ip}")
+
+    def evaluar(self, ip, now):
+        # Decide si una IP con intentos nuevos debe bloquearse
+        if self.bloqueo_vigente(ip):
+            return  # Sigue bloqueada
+        now_epoch = int(now.timestamp())
+        if AGGREGATE_MIN_IPS:
+            desbloqueada_subred = self.desbloqueadas.get(subred_de(ip))
+            if desbloqueada_subred and now - desbloqueada_subred <= REBLOCK_AFTER:
+                return  # Su subred agrupada está en tiempo de gracia
+        if ip in self.desbloqueadas:
+            if now - self.desbloqueadas[ip] <= REBLOCK_AFTER:
+                return  # Todavía en tiempo de gracia
+            if self.ventana.supera_umbral(ip, now_epoch):
+                self.bloquear(ip, now, f"Rebloqueada IP: {ip} tras seguir atacando")
+        elif self.ventana.supera_umbral(ip, now_epoch):
+            intentos = self.ventana.recientes(ip, now_epoch)
+            self.bloquear(ip, now, f"Bloqueada IP nueva: {ip} con {intentos} intentos fallidos")
+
+    def procesar_vencimientos(self, now):
+        # Saca del heap sólo lo que ya venció; una entrada es válida si coincide con el estado actual
+        now_epoch = int(now.timestamp())
+        while self.vencimientos and self.vencimientos[0][0] <= now_epoch:
+            epoch, tipo, ip = heapq.heappop(self.vencimientos)
+            if tipo == 'bloqueo':
+                bloqueado_hasta = self.bloqueadas_hasta.get(ip)
+                if bloqueado_hasta is not None and int(bloqueado_hasta.timestamp()) == epoch:
+                    self.desbloquear(ip, now)
             else:
-                # Todavía en tiempo de gracia, conservar registro desbloqueado
-                updated_unblocked.append({
-                    "ip": ip,
-                    "desbloqueada": tiempo_desbloqueo.isoformat()
-#                    "pais_origen": get_country(ip)
-                })
+                desbloqueada = self.desbloqueadas.get(ip)
+                if desbloqueada is not None and int((desbloqueada + REBLOCK_AFTER).timestamp()) == epoch:
+                    # Terminó el tiempo de gracia: si siguió atacando se re-bloquea, si no se olvida
+                    if self.ventana.supera_umbral(ip, now_epoch):
+                        self.bloquear(ip, now, f"Rebloqueada IP: {ip} tras seguir atacando")
+                    else:
+                        del self.desbloqueadas[ip]
+                        self.paises.pop(ip, None)
+                        self.cambiadas.add(ip)
+                        if '/' in ip:
+                            self.evaluar_subred(ip, now)
 
+    def evaluar_subred(self, subred, now):
+        # La ventana cuenta por IP: al terminar la gracia de una subred agrupada se evalúan sus IPs,
+        # que evaluar() saltó mientras duraba
+        for ip in [ip for ip in self.ventana.intentos if subred_de(ip) == subred]:
+            self.evaluar(ip, now)
+
+    def proximo_vencimiento(self):
+        # Epoch del próximo vencimiento, o None si no hay ninguno
+        return self.vencimientos[0][0] if self.vencimientos else None
+
+    def aplicar_firewall(self):
+        # Aplica en una sola transacción los cambios acumulados; si falla quedan pendientes
+        self.firewall.aplicar(self.pendientes_bloqueo, self.pendientes_desbloqueo)
+        self.pendientes_bloqueo = {}
+        self.pendientes_desbloqueo = set()
+
+    def guardar(self, estado, checkpoint):
+        # Escribe sólo las IPs que cambiaron, en la misma transacción que el checkpoint
+        bloqueadas = {ip: self.bloqueadas.get(ip) for ip in self.cambiadas}
+        desbloqueadas = {}
+        for ip in self.cambiadas:
+            desbloqueada = self.desbloqueadas.get(ip)
+            desbloqueadas[ip] = {
+                "ip": ip,
+                "desbloqueada": desbloqueada.isoformat(),
+                "pais_origen": self.paises.get(ip, "Unknown")
+            } if desbloqueada else None
+        ventana = self.ventana.cambios()
+        try:
+            estado.confirmar(bloqueadas, desbloqueadas, checkpoint, ventana)
+        except Exception:
+            self.ventana.cambiadas.update(ventana)  # Se reintentan en el próximo guardado
+            raise
+        self.cambiadas = set()
+
+def preparar():
+    # Carga estado, checkpoint y ventana de intentos de la ejecución anterior
+    with METRICAS.medir('estado_carga'):
+        estado = EstadoBloqueos(state_db)
+        checkpoint = estado.cargar_checkpoint()  # Hasta dónde se leyó el log la última vez
+        ventana = VentanaIntentos.desde_dict(estado.cargar_ventana(), FAILED_ATTEMPTS_THRESHOLD, FAILED_ATTEMPTS_WINDOW)
+        bloqueador = Bloqueador(crear_backend(FIREWALL_BACKEND), ventana, ListaBlanca(whitelist_ips), BuscadorPais())
+        bloqueador.cargar(estado.bloqueadas(), estado.desbloqueadas())
+    return bloqueador, estado, checkpoint
+
+def confirmar(bloqueador, estado, checkpoint, now, rollup=None):
+    # Primero el firewall y después estado + checkpoint en una transacción: si algo falla a mitad,
+    # la próxima vuelta reintenta los mismos cambios en vez de perder intentos.
+    # El rollup va al final: si su transacción falla, esos conteos se pierden pero nunca se duplican.
+    # Devuelve True si el bloqueo quedó guardado.
+    try:
+        with METRICAS.medir('firewall'):
+            bloqueador.aplicar_firewall()
+    except Exception as e:
+        METRICAS.contar('errores_firewall')
+        METRICAS.escribir(len(bloqueador.bloqueadas))
+        registrar_evento(f"Error aplicando cambios en el firewall ({FIREWALL_BACKEND}): {e}")
+        return False
+    with METRICAS.medir('estado_guardado'):
+        bloqueador.ventana.purgar_vencidas(int(now.timestamp()))
+        bloqueador.guardar(estado, checkpoint)
+    if rollup is not None and checkpoint['mailbox'] is not None:
+        try:
+            with METRICAS.medir('rollup'):
+                rollup.confirmar(checkpoint['mailbox'])
+        except sqlite3.Error as e:
+            registrar_evento(f"Error actualizando el índice horario {MAILBOX_ROLLUP_PATH}: {e}")
+    METRICAS.escribir(len(bloqueador.bloqueadas))
+    return True
+
+# --- Modo cron: una pasada sobre las líneas nuevas ---
+def ejecutar_cron():
+    bloqueador, estado, checkpoint = preparar()
+    ips_vistas = set()  # IPs con intentos nuevos en esta ejecución
+    rollup = crear_rollup()
+    fuentes = crear_fuentes([consumidor_bloqueo(bloqueador, ips_vistas.add), consumidor_metricas], rollup)
+    try:
+        with METRICAS.medir('lectura'):
+            leer_fuentes(fuentes, checkpoint)
+    except Exception as e:
+        # Sin guardar checkpoint: la próxima ejecución vuelve a leer desde el mismo punto
+        registrar_evento(f"Error leyendo log: {e}")
+        return
+
+    now = datetime.now()  # Tiempo actual para comparaciones
+    bloqueador.procesar_vencimientos(now)  # Primero, desbloquear IPs cuyo tiempo de bloqueo expiró
+    for ip in ips_vistas:
+        bloqueador.evaluar(ip, now)
+    confirmar(bloqueador, estado, checkpoint, now, rollup)
+
+# --- Modo backfill: reconstruir el historial desde los logs rotados ---
+def archivos_rotados(path, desde=None):
+    # maillog.1 ... maillog.N(.gz) y maillog-AAAAMMDD(.gz), del más viejo al más nuevo.
+    # Con 'desde' (epoch) se descartan los que no se escribieron después: su última línea es
+    # anterior y ninguno de sus intentos puede caer en la ventana
+    candidatos = set(glob.glob(path + '.*')) | set(glob.glob(path + '-*'))
+    candidatos = [c for c in candidatos if not c.endswith('.tmp')]
+    if desde is not None:
+        candidatos = [c for c in candidatos if os.path.getmtime(c) >= desde]
+    return sorted(candidatos, key=os.path.getmtime)
+
+def resumir_archivo(path, umbral, origen='maillog'):
+    # Worker: recorre un archivo (plano o gzip) y devuelve por IP (total de intentos, últimos epochs).
+    # Con los 'umbral' últimos alcanza para reconstruir la ventana, así el resultado es compacto.
+    if origen == 'mailbox':
+        detector = DetectorMailbox()
+    else:
+        detector = ParserSyslog(referencia=datetime.fromtimestamp(os.path.getmtime(path)))
+    resumen = {}
+
+    def acumular(evento):
+        if not cuenta_para_bloqueo(evento):
+            return
+        entrada = resumen.get(evento.ip)
+        if entrada is None:
+            entrada = resumen[evento.ip] = [0, deque(maxlen=umbral)]
+        entrada[0] += 1
+        entrada[1].append(evento.epoch)
+
+    abrir = gzip.open if path.endswith('.gz') else open
+    with abrir(path, 'rb') as f:
+        Ingesta([detector], [acumular]).procesar_archivo(f)
+    return {ip: (total, list(epochs)) for ip, (total, epochs) in resumen.items()}
+
+def ejecutar_backfill():
+    bloqueador, estado, checkpoint = preparar()
+    # Sólo se guarda la ventana (confirmar purga lo que tiene más de FAILED_ATTEMPTS_WINDOW), así que
+    # se leen únicamente los rotados modificados dentro de ella; los más viejos no aportan nada
+    desde = (datetime.now() - FAILED_ATTEMPTS_WINDOW).timestamp()
+    origenes = {archivo: 'maillog' for archivo in archivos_rotados(log_path, desde)}
+    if mailbox_log_path:
+        origenes.update({archivo: 'mailbox' for archivo in archivos_rotados(mailbox_log_path, desde)})
+    archivos = sorted(origenes, key=os.path.getmtime)
+    if not archivos:
+        registrar_evento(f"Backfill: no hay archivos rotados de {log_path} escritos en los últimos "
+                         f"{FAILED_ATTEMPTS_WINDOW}")
+        return
+    intentos = 0
+    # Se reconstruye aparte y se fusiona después: la ventana del checkpoint ya tiene los intentos
+    # que el cron leyó de estos mismos archivos antes de que rotaran
+    reconstruida = VentanaIntentos(FAILED_ATTEMPTS_THRESHOLD, FAILED_ATTEMPTS_WINDOW)
+    with ProcessPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        # map conserva el orden de 'archivos' (cronológico), que es el orden en que hay que fusionar
+        resultados = pool.map(resumir_archivo, archivos, [FAILED_ATTEMPTS_THRESHOLD] * len(archivos),
+                              [origenes[archivo] for archivo in archivos])
+        ips = set()
+        for resumen in resultados:
+            for ip, (total, epochs) in resumen.items():
+                if not bloqueador.lista_blanca.contiene(ip):
+                    for epoch in epochs:
+                        reconstruida.registrar(ip, epoch)
+                    intentos += total
+                    ips.add(ip)
+    bloqueador.ventana.fusionar(reconstruida)
+    now = datetime.now()
+    bloqueador.procesar_vencimientos(now)
+    for ip in ips:
+        bloqueador.evaluar(ip, now)  # Sólo bloquea lo que sigue dentro de la ventana
+    registrar_evento(f"Backfill: {len(archivos)} archivos, {intentos} intentos fallidos de {len(ips)} IPs")
+    confirmar(bloqueador, estado, checkpoint, now)
+
+# --- Modo daemon: seguir el log a medida que crece ---
+class EsperaLog:
+    """
+    Espera a que algún log cambie: con inotify (si inotify_simple está instalado) despierta apenas
+    se escribe o rota un archivo; si no, duerme el intervalo de polling.
+    """
+
+    def __init__(self, paths):
+        self.inotify = None
+        if INotify is not None:
+            self.inotify = INotify()
+            # Se vigilan los directorios para enterarse también de la rotación (archivo nuevo / renombrado)
+            for directorio in {os.path.dirname(path) or '.' for path in paths}:
+                self.inotify.add_watch(directorio, inotify_flags.MODIFY | inotify_flags.CREATE | inotify_flags.MOVED_TO)
+
+    def esperar(self, segundos):
+        if self.inotify is not None:
+            self.inotify.read(timeout=int(segundos * 1000))
         else:
-            # IP nueva, nunca vista antes
-            if len(timestamps) >= FAILED_ATTEMPTS_THRESHOLD:
-                # Bloquear IP nueva con intentos suficientes
-                bloqueado_desde = now
-                bloqueado_hasta = bloqueado_desde + BLOCK_DURATION
-                subprocess.run(['/usr/sbin/iptables', '-I', 'INPUT', '-s', ip, '-j', 'DROP'])
-                logf.write(f"{now} - Bloqueada IP nueva: {ip} con {len(timestamps)} intentos fallidos\n")
-                new_entry = {
-                    "ip": ip,
-                    "bloqueado_desde": bloqueado_desde.isoformat(),
-                    "bloqueado_hasta": bloqueado_hasta.isoformat()
-#                    "pais_origen": get_country(ip)
-                }
-                updated_blocked.append(new_entry)
-                blocked_ips[ip] = bloqueado_hasta
-
-    # Guardar estado actualizado de bloqueadas y desbloqueadas en archivos JSON
-    save_json(blocked_json, updated_blocked)
-    save_json(unblocked_json, updated_unblocked)
+            time.sleep(segundos)
+
+def ejecutar_daemon():
+    bloqueador, estado, checkpoint = preparar()
+
+    def al_intento(ip):
+        # Decidir en el momento: la IP queda bloqueada en la misma vuelta en que cruza el umbral
+        bloqueador.evaluar(ip, datetime.now())
+
+    rollup = crear_rollup()
+    fuentes = crear_fuentes([consumidor_bloqueo(bloqueador, al_intento), consumidor_metricas], rollup)
+    espera = EsperaLog([path for path, _, _ in fuentes])
+    detener = []
+
+    def al_recibir_senal(signum, frame):
+        detener.append(signum)
+
+    signal.signal(signal.SIGTERM, al_recibir_senal)
+    signal.signal(signal.SIGINT, al_recibir_senal)
+    registrar_evento(f"Daemon iniciado ({'inotify' if espera.inotify else 'polling'})")
+
+    ultimo_guardado = time.monotonic()
+    while not detener:
+        try:
+            with METRICAS.medir('lectura'):
+                leer_fuentes(fuentes, checkpoint)
+        except Exception as e:
+            registrar_evento(f"Error leyendo log: {e}")
+
+        now = datetime.now()
+        bloqueador.procesar_vencimientos(now)
+        hay_pendientes = bloqueador.pendientes_bloqueo or bloqueador.pendientes_desbloqueo
+        if hay_pendientes or bloqueador.cambiadas or time.monotonic() - ultimo_guardado >= DAEMON_CHECKPOINT_INTERVAL:
+            if confirmar(bloqueador, estado, checkpoint, now, rollup):
+                ultimo_guardado = time.monotonic()
+
+        # Dormir hasta el próximo vencimiento, como mucho el intervalo de polling
+        espera_max = DAEMON_POLL_INTERVAL
+        proximo = bloqueador.proximo_vencimiento()
+        if proximo is not None:
+            espera_max = max(0.0, min(espera_max, proximo - time.time()))
+        espera.esperar(espera_max)
+
+    confirmar(bloqueador, estado, checkpoint, datetime.now(), rollup)
+    registrar_evento("Daemon detenido")
+
+def tomar_bloqueo(path):
+    # Una sola ejecución a la vez sobre el estado: dos cron solapados (o cron y daemon) leerían las
+    # mismas líneas y pisarían el checkpoint del otro. Devuelve el archivo bloqueado (mantenerlo
+    # abierto mientras dure la ejecución) o None si otra ejecución lo tiene.
+    f = open(path + '.lock', 'w')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def ejecutar_perfilado(funcion, archivo_perfil=None, memoria=False):
+    # Corre el modo elegido bajo cProfile y/o tracemalloc para medir regresiones con logs reales
+    perfil = cProfile.Profile() if archivo_perfil else None
+    if memoria:
+        tracemalloc.start()
+    if perfil:
+        perfil.enable()
+    try:
+        funcion()
+    finally:
+        if perfil:
+            perfil.disable()
+            perfil.dump_stats(archivo_perfil)
+            pstats.Stats(perfil).sort_stats('cumulative').print_stats(25)
+        if memoria:
+            actual, pico = tracemalloc.get_traced_memory()
+            print(f"Memoria (tracemalloc): actual {actual / 1024 / 1024:.1f} MB, pico {pico / 1024 / 1024:.1f} MB")
+            for estadistica in tracemalloc.take_snapshot().statistics('lineno')[:10]:
+                print(estadistica)
+            tracemalloc.stop()
+
+def main():
+    argp = argparse.ArgumentParser(description="Bloquea IPs con fallos SASL repetidos en el log de correo.")
+    argp.add_argument('--modo', choices=('cron', 'daemon', 'backfill'), default='cron',
+                      help="cron: una pasada sobre las líneas nuevas (por defecto); daemon: seguir el log; "
+                           "backfill: reconstruir la ventana de intentos desde los logs rotados (.N y .gz) en paralelo; "
+                           "sólo se leen los modificados dentro de FAILED_ATTEMPTS_WINDOW")
+    argp.add_argument('--exportar-json', action='store_true',
+                      help="vuelca el estado actual a ips_bloqueadas.json / ips_desbloqueadas.json y termina")
+    argp.add_argument('--perfil', metavar='ARCHIVO',
+                      help="perfila la ejecución con cProfile, guarda las estadísticas en ARCHIVO y muestra un resumen")
+    argp.add_argument('--tracemalloc', action='store_true',
+                      help="mide la memoria con tracemalloc y muestra las líneas que más reservan")
+    args = argp.parse_args()
+    if args.exportar_json:
+        EstadoBloqueos(state_db).exportar_json()
+        return
+    modos = {'cron': ejecutar_cron, 'daemon': ejecutar_daemon, 'backfill': ejecutar_backfill}
+    bloqueo = tomar_bloqueo(state_db)
+    if bloqueo is None:
+        registrar_evento(f"Modo {args.modo} no iniciado: otra ejecución tiene el estado {state_db}")
+        sys.exit(1)
+    if args.perfil or args.tracemalloc:
+        METRICAS.activo = True  # Al perfilar también interesan los tiempos finos por fase
+        ejecutar_perfilado(modos[args.modo], args.perfil, args.tracemalloc)
+    else:
+        modos[args.modo]()
 
+if __name__ == '__main__':
+    main()